@@ -0,0 +1,95 @@
+"""
+Auth session registry in Redis
+
+Every VK login session is a hash `auth_session:<id>`
+(vk_account_id, status, created_at, updated_at, error) with a TTL, so any
+API process and the auth worker see the same state and a restart loses
+nothing. The TTL is refreshed on every status change; abandoned sessions
+expire on their own.
+
+Status changes go through a Lua compare-and-set: the transition applies
+only while the session exists and its status is one of the expected ones,
+so two API processes racing on /complete and DELETE cannot both win.
+
+Statuses: pending -> ready -> completing -> completed | failed,
+pending | ready -> cancelled.
+Mirror of worker/auth_registry.py - keep the two in sync.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+
+KEY_PREFIX = "auth_session:"
+OPEN_STATUSES = ("pending", "ready")
+
+# KEYS[1] - session hash; ARGV: ttl, expected statuses ("" - any), then field/value pairs.
+# Returns the previous status, or false if the session is gone or in another status.
+SET_STATUS = """
+local current = redis.call('HGET', KEYS[1], 'status')
+if not current then
+    return false
+end
+if ARGV[2] ~= '' then
+    local allowed = false
+    for status in string.gmatch(ARGV[2], '[^,]+') do
+        if status == current then
+            allowed = true
+            break
+        end
+    end
+    if not allowed then
+        return false
+    end
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return current
+"""
+
+
+def registry_key(session_id: str) -> str:
+    return KEY_PREFIX + session_id
+
+
+class AuthRegistry:
+    def __init__(self, redis_client, ttl: int = 900):
+        self.redis = redis_client
+        self.ttl = ttl
+        self._set_status = redis_client.register_script(SET_STATUS)
+
+    async def create(self, session_id: str, vk_account_id: str) -> dict:
+        now = datetime.utcnow().isoformat()
+        session = {
+            "vk_account_id": vk_account_id,
+            "status": "pending",
+            "created_at": now,
+            "updated_at": now
+        }
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(registry_key(session_id), mapping=session)
+            pipe.expire(registry_key(session_id), self.ttl)
+            await pipe.execute()
+        return session
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        session = await self.redis.hgetall(registry_key(session_id))
+        return session or None
+
+    async def set_status(
+        self,
+        session_id: str,
+        status: str,
+        expect: Optional[Iterable[str]] = None,
+        **fields: str
+    ) -> Optional[str]:
+        """Atomic transition; returns the previous status or None if it did not apply"""
+        args = [self.ttl, ",".join(expect or ()), "status", status,
+                "updated_at", datetime.utcnow().isoformat()]
+        for name, value in fields.items():
+            args += [name, "" if value is None else str(value)]
+        previous = await self._set_status(keys=[registry_key(session_id)], args=args)
+        return previous if previous else None
+
+    async def delete(self, session_id: str):
+        await self.redis.delete(registry_key(session_id))
@@ -1,5 +1,10 @@
 """
-Database and Redis utilities for routers
+Shared Postgres and Redis resources for the API process
+
+One engine and two Redis connection pools, used by main.py and every router:
+redis_client for ordinary short commands, redis_stream_client for connections
+held for long - pub/sub (WebSockets, invalidation listeners) and blocking
+commands such as BLPOP - so those can never starve regular requests.
 """
 import redis.asyncio as redis
 from pydantic_settings import BaseSettings
@@ -9,7 +14,24 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 class Settings(BaseSettings):
     database_url: str
     redis_url: str
-    
+    jwt_secret: str
+    session_secret: str  # encrypts vk_accounts.session_data_encrypted, shared with workers
+    environment: str = "production"
+    principal_cache_ttl: int = 30  # seconds, per-process
+    principal_redis_ttl: int = 300  # seconds, shared
+    auth_session_ttl: int = 900  # seconds, refreshed on every auth session status change
+    auth_complete_timeout: int = 30  # seconds /auth-sessions/{id}/complete waits for the auth worker
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32  # beyond this, /auth requests get 503
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: int = 30  # seconds to wait for a free connection
+    db_pool_recycle: int = 1800  # seconds
+    db_statement_cache_size: int = 500  # prepared statements per connection
+    redis_max_connections: int = 100  # short commands only
+    redis_stream_max_connections: int = 200  # pub/sub (WebSockets) and blocking commands (BLPOP)
+    redis_pool_timeout: int = 5  # seconds to wait for a free connection
+
     class Config:
         env_file = ".env"
 
@@ -17,13 +39,74 @@ class Settings(BaseSettings):
 settings = Settings()
 DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://")
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    connect_args={"prepared_statement_cache_size": settings.db_statement_cache_size}
+)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-# Global Redis client
-redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+redis_pool = redis.BlockingConnectionPool.from_url(
+    settings.redis_url,
+    decode_responses=True,
+    max_connections=settings.redis_max_connections,
+    timeout=settings.redis_pool_timeout
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+redis_stream_pool = redis.BlockingConnectionPool.from_url(
+    settings.redis_url,
+    decode_responses=True,
+    max_connections=settings.redis_stream_max_connections,
+    timeout=settings.redis_pool_timeout
+)
+redis_stream_client = redis.Redis(connection_pool=redis_stream_pool)
 
 
 async def get_db():
     async with async_session() as session:
         yield session
+
+
+async def get_redis():
+    return redis_client
+
+
+async def get_stream_redis():
+    return redis_stream_client
+
+
+def pool_stats() -> dict:
+    """Connection pool utilization for /health and /metrics"""
+    db_pool = engine.pool
+    return {
+        "db": {
+            "size": db_pool.size(),
+            "checked_out": db_pool.checkedout(),
+            "overflow": db_pool.overflow(),
+            "max": settings.db_pool_size + settings.db_max_overflow
+        },
+        "redis": {
+            "in_use": len(redis_pool._in_use_connections),
+            "idle": len(redis_pool._available_connections),
+            "max": settings.redis_max_connections
+        },
+        "redis_stream": {
+            "in_use": len(redis_stream_pool._in_use_connections),
+            "idle": len(redis_stream_pool._available_connections),
+            "max": settings.redis_stream_max_connections
+        }
+    }
+
+
+async def close_resources():
+    await redis_client.close()
+    await redis_pool.disconnect()
+    await redis_stream_client.close()
+    await redis_stream_pool.disconnect()
+    await engine.dispose()
@@ -3,51 +3,41 @@ Dating Bot Platform - API
 """
 import os
 import json
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 from contextlib import asynccontextmanager
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from pydantic_settings import BaseSettings
-import redis.asyncio as redis
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ConfigDict, EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import uuid
 
+from database import settings, async_session, get_db, get_redis, get_stream_redis, pool_stats, close_resources
+from task_queue import route_task, queue_stats
+from principal_cache import PrincipalCache
+from password_hasher import PasswordHasher, PoolSaturated
 
-class Settings(BaseSettings):
-    database_url: str
-    redis_url: str
-    jwt_secret: str
-    environment: str = "production"
-    
-    class Config:
-        env_file = ".env"
-
-settings = Settings()
-DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://")
-
-engine = create_async_engine(DATABASE_URL, echo=False)
-async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-
-async def get_db():
-    async with async_session() as session:
-        yield session
-
-redis_pool = None
 
-async def get_redis():
-    global redis_pool
-    if redis_pool is None:
-        redis_pool = redis.from_url(settings.redis_url, decode_responses=True)
-    return redis_pool
+# Updates to clients rows evict cached principals through the client_changed
+# NOTIFY trigger; principal_cache.invalidate(client_id) is the in-process shortcut
+principal_cache = PrincipalCache(
+    get_redis,
+    get_stream_redis=get_stream_redis,
+    local_ttl=settings.principal_cache_ttl,
+    redis_ttl=settings.principal_redis_ttl
+)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending
+)
 security = HTTPBearer()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
@@ -58,16 +48,19 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.jwt_secret, algorithm=ALGORITHM)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Too many login attempts, retry later", headers={"Retry-After": "1"})
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Too many registrations, retry later", headers={"Retry-After": "1"})
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
-):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, settings.jwt_secret, algorithms=[ALGORITHM])
         client_id: str = payload.get("sub")
@@ -76,14 +69,19 @@ async def get_current_user(
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    result = await db.execute(
-        text("SELECT * FROM clients WHERE id = :id AND is_active = true"),
-        {"id": client_id}
-    )
-    user = result.fetchone()
-    if user is None:
+    user = await principal_cache.get(client_id)
+    if user is not None:
+        return user
+    
+    async with async_session() as db:
+        result = await db.execute(
+            text("SELECT * FROM clients WHERE id = :id AND is_active = true"),
+            {"id": client_id}
+        )
+        row = result.fetchone()
+    if row is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    return await principal_cache.set(client_id, row)
 
 
 class ClientCreate(BaseModel):
@@ -123,20 +121,37 @@ class BotConfigCreate(BaseModel):
     swipe_interval_minutes: int = 30
     dialogue_style: str = "balanced"
 
+class QuestFilters(BaseModel):
+    """Keys read by the worker's QuestScorer; anything else is rejected"""
+    model_config = ConfigDict(extra="forbid")
+
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    min_score: Optional[int] = None
+    superlike_score: Optional[int] = None
+    interests: Optional[list[str]] = None
+    negative_keywords: Optional[list[str]] = None
+    keyword_weights: Optional[dict[str, int]] = None
+
 class BotConfigUpdate(BaseModel):
+    # null means "leave unchanged": None fields are dropped before the UPDATE
     active_quest: Optional[str] = None
-    quest_filters: Optional[dict] = None
+    quest_filters: Optional[QuestFilters] = None
     boost_times: Optional[list[str]] = None
+    boost_timezone: Optional[str] = None
     is_active: Optional[bool] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 Starting Dating Bot API...")
+    invalidation_listener = asyncio.create_task(principal_cache.listen_invalidations())
+    client_change_listener = asyncio.create_task(principal_cache.listen_client_changes(settings.database_url))
     yield
-    global redis_pool
-    if redis_pool:
-        await redis_pool.close()
+    invalidation_listener.cancel()
+    client_change_listener.cancel()
+    password_hasher.shutdown()
+    await close_resources()
     print("👋 Shutting down...")
 
 app = FastAPI(title="Dating Bot Platform API", version="1.0.0", lifespan=lifespan)
@@ -162,11 +177,51 @@ async def health_check(db: AsyncSession = Depends(get_db)):
         await db.execute(text("SELECT 1"))
         redis_client = await get_redis()
         await redis_client.ping()
-        return {"status": "healthy", "database": "connected", "redis": "connected", "timestamp": datetime.utcnow().isoformat()}
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "redis": "connected",
+            "pools": pool_stats(),
+            "password_hasher": password_hasher.stats(),
+            "timestamp": datetime.utcnow().isoformat()
+        }
     except Exception as e:
         raise HTTPException(status_code=503, detail=str(e))
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text format: connection pools, password hasher, principal cache, task queue"""
+    pools = pool_stats()
+    hasher = password_hasher.stats()
+    cache = principal_cache.stats()
+    queue = await queue_stats(await get_redis())
+    lines = [
+        f"api_db_pool_size {pools['db']['size']}",
+        f"api_db_pool_checked_out {pools['db']['checked_out']}",
+        f"api_db_pool_overflow {pools['db']['overflow']}",
+        f"api_db_pool_max {pools['db']['max']}",
+        f"api_redis_pool_in_use {pools['redis']['in_use']}",
+        f"api_redis_pool_idle {pools['redis']['idle']}",
+        f"api_redis_pool_max {pools['redis']['max']}",
+        f"api_redis_stream_pool_in_use {pools['redis_stream']['in_use']}",
+        f"api_redis_stream_pool_idle {pools['redis_stream']['idle']}",
+        f"api_redis_stream_pool_max {pools['redis_stream']['max']}",
+        f"api_password_hash_queue_depth {hasher['queue_depth']}",
+        f"api_password_hash_shed_total {hasher['shed_total']}",
+        f"api_principal_cache_size {cache['size']}",
+        f"api_principal_cache_hits_total {cache['hits']}",
+        f"api_principal_cache_misses_total {cache['misses']}",
+        f"api_task_queue_length {queue['queue_length']}",
+        f"api_task_queue_inbox_length {queue['inbox_length']}",
+        f"api_task_queue_workers {queue['workers']}",
+        f"api_task_queue_processing {queue['processing']}",
+        f"api_task_queue_retrying {queue['retrying']}",
+        f"api_task_queue_dead_letter {queue['dead_letter']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
 @app.post("/auth/register", response_model=TokenResponse)
 async def register(client: ClientCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(text("SELECT id FROM clients WHERE email = :email"), {"email": client.email})
@@ -174,7 +229,7 @@ async def register(client: ClientCreate, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     client_id = str(uuid.uuid4())
-    password_hash = get_password_hash(client.password)
+    password_hash = await get_password_hash(client.password)
     
     await db.execute(
         text("INSERT INTO clients (id, email, password_hash) VALUES (:id, :email, :password_hash)"),
@@ -194,7 +249,7 @@ async def login(client: ClientLogin, db: AsyncSession = Depends(get_db)):
     )
     row = result.fetchone()
     
-    if not row or not verify_password(client.password, row.password_hash):
+    if not row or not await verify_password(client.password, row.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token({"sub": str(row.id)})
@@ -278,11 +333,13 @@ async def start_bot(account_id: str, current_user = Depends(get_current_user), d
     
     redis_client = await get_redis()
     task = {"type": "start_session", "client_id": str(current_user.id), "vk_account_id": account_id, "timestamp": datetime.utcnow().isoformat()}
-    await redis_client.lpush("task_queue", json.dumps(task))
+    await route_task(redis_client, task)
     
     await db.execute(text("UPDATE vk_accounts SET status = 'starting' WHERE id = :id"), {"id": account_id})
     await db.execute(text("UPDATE bot_configs SET is_active = true WHERE vk_account_id = :id"), {"id": account_id})
     await db.commit()
+    # The scheduler puts the account on its boost timeline
+    await redis_client.publish(f"control:{account_id}", "start")
     
     return {"status": "starting", "message": "Bot is being started"}
 
@@ -303,21 +360,64 @@ async def stop_bot(account_id: str, current_user = Depends(get_current_user), db
     return {"status": "stopped"}
 
 
+@app.patch("/vk-accounts/{account_id}/config")
+async def update_bot_config(
+    account_id: str,
+    config: BotConfigUpdate,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(text("SELECT id FROM vk_accounts WHERE id = :id AND client_id = :client_id"), {"id": account_id, "client_id": str(current_user.id)})
+    if not result.fetchone():
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    updates = config.model_dump(exclude_unset=True, exclude_none=True)
+    if not updates:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    if "boost_timezone" in updates:
+        try:
+            ZoneInfo(updates["boost_timezone"])
+        except (ZoneInfoNotFoundError, ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Unknown boost_timezone")
+
+    assignments = []
+    params = {"id": account_id}
+    for field, value in updates.items():
+        if field == "quest_filters":
+            assignments.append("quest_filters = CAST(:quest_filters AS jsonb)")
+            value = json.dumps(value)
+        else:
+            assignments.append(f"{field} = :{field}")
+        params[field] = value
+
+    await db.execute(text(f"UPDATE bot_configs SET {', '.join(assignments)} WHERE vk_account_id = :id"), params)
+    await db.commit()
+
+    # A running bot swaps its config in place, without relaunching the browser
+    redis_client = await get_redis()
+    await redis_client.publish(f"control:{account_id}", "reload_config")
+
+    return {"status": "updated", "fields": sorted(updates)}
+
+
 @app.get("/stats")
 async def get_stats(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     client_id = str(current_user.id)
     
+    # Counters are maintained by triggers on activity_log and dialogues (postgres/init.sql)
     result = await db.execute(
-        text("SELECT action_type, COUNT(*) as count, COUNT(CASE WHEN result = 'success' THEN 1 END) as success_count FROM activity_log WHERE client_id = :client_id AND created_at > CURRENT_DATE GROUP BY action_type"),
+        text("SELECT action_type, total, success FROM client_daily_stats WHERE client_id = :client_id AND day = CURRENT_DATE"),
         {"client_id": client_id}
     )
-    today_stats = {row.action_type: {"total": row.count, "success": row.success_count} for row in result.fetchall()}
-    
-    result = await db.execute(text("SELECT COUNT(*) as count FROM dialogues WHERE client_id = :client_id AND outcome IS NULL"), {"client_id": client_id})
-    active_dialogues = result.fetchone().count
+    today_stats = {row.action_type: {"total": row.total, "success": row.success} for row in result.fetchall()}
     
-    result = await db.execute(text("SELECT COUNT(*) as count FROM dialogues WHERE client_id = :client_id AND outcome = 'goal_reached'"), {"client_id": client_id})
-    completed_quests = result.fetchone().count
+    result = await db.execute(
+        text("SELECT active_dialogues, completed_quests FROM client_stats WHERE client_id = :client_id"),
+        {"client_id": client_id}
+    )
+    row = result.fetchone()
+    active_dialogues = row.active_dialogues if row else 0
+    completed_quests = row.completed_quests if row else 0
     
     return {"today": today_stats, "active_dialogues": active_dialogues, "completed_quests": completed_quests}
 
@@ -325,8 +425,8 @@ async def get_stats(current_user = Depends(get_current_user), db: AsyncSession =
 @app.get("/queue/status")
 async def queue_status(current_user = Depends(get_current_user)):
     redis_client = await get_redis()
-    queue_len = await redis_client.llen("task_queue")
-    return {"queue_length": queue_len, "timestamp": datetime.utcnow().isoformat()}
+    stats = await queue_stats(redis_client)
+    return {**stats, "timestamp": datetime.utcnow().isoformat()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""
+Password hashing off the event loop
+
+bcrypt runs on a dedicated, bounded thread pool (bcrypt releases the GIL),
+so a login burst no longer blocks WebSocket streams and other requests.
+When more than max_pending calls are queued, new calls are shed with
+PoolSaturated instead of piling up behind the pool.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = 2, max_pending: int = 32):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.shed = 0
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            raise PoolSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.pending,
+            "max_pending": self.max_pending,
+            "shed_total": self.shed
+        }
@@ -0,0 +1,178 @@
+"""
+Authenticated principal cache
+
+Two tiers: a small in-process LRU with a short TTL, backed by Redis
+(`principal:<client_id>`) so every API process shares warm entries.
+Entries are dropped explicitly through invalidate(), which deletes the
+Redis key and broadcasts on `principal_invalidate` so every process
+evicts its local copy. Changes made outside the API (admin SQL, billing)
+arrive as Postgres NOTIFY `client_changed` from a trigger on clients.
+The TTLs bound staleness if a notification is missed.
+"""
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "principal_invalidate"
+CLIENT_CHANGED_CHANNEL = "client_changed"  # pg_notify from trigger_clients_notify
+
+# password_hash is deliberately left out of the cache
+PRINCIPAL_FIELDS = ("id", "email", "subscription_tier", "subscription_until", "settings", "is_active", "created_at", "updated_at")
+DATETIME_FIELDS = ("subscription_until", "created_at", "updated_at")
+
+
+def _to_json(row) -> str:
+    data = {}
+    for field in PRINCIPAL_FIELDS:
+        value = getattr(row, field, None)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif field == "id" and value is not None:
+            value = str(value)
+        data[field] = value
+    return json.dumps(data)
+
+
+def _from_json(raw: str) -> SimpleNamespace:
+    data = json.loads(raw)
+    for field in DATETIME_FIELDS:
+        if data.get(field):
+            data[field] = datetime.fromisoformat(data[field])
+    return SimpleNamespace(**data)
+
+
+class PrincipalCache:
+    def __init__(
+        self,
+        get_redis: Callable[[], Awaitable],
+        get_stream_redis: Optional[Callable[[], Awaitable]] = None,
+        local_ttl: int = 30,
+        redis_ttl: int = 300,
+        maxsize: int = 10000
+    ):
+        self.get_redis = get_redis
+        # The pub/sub listener holds its connection for the process lifetime
+        self.get_stream_redis = get_stream_redis or get_redis
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.maxsize = maxsize
+        self.local: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, client_id: str) -> str:
+        return f"principal:{client_id}"
+
+    def _put_local(self, client_id: str, principal: SimpleNamespace):
+        self.local[client_id] = (time.monotonic() + self.local_ttl, principal)
+        self.local.move_to_end(client_id)
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    async def get(self, client_id: str) -> Optional[SimpleNamespace]:
+        entry = self.local.get(client_id)
+        if entry:
+            expires_at, principal = entry
+            if expires_at > time.monotonic():
+                self.local.move_to_end(client_id)
+                self.hits += 1
+                return principal
+            del self.local[client_id]
+
+        try:
+            redis_client = await self.get_redis()
+            raw = await redis_client.get(self._key(client_id))
+        except Exception:
+            # Redis is only a cache tier - fall back to the database
+            raw = None
+        if raw:
+            principal = _from_json(raw)
+            self._put_local(client_id, principal)
+            self.hits += 1
+            return principal
+
+        self.misses += 1
+        return None
+
+    async def set(self, client_id: str, row) -> SimpleNamespace:
+        raw = _to_json(row)
+        principal = _from_json(raw)
+        try:
+            redis_client = await self.get_redis()
+            await redis_client.set(self._key(client_id), raw, ex=self.redis_ttl)
+        except Exception:
+            pass
+        self._put_local(client_id, principal)
+        return principal
+
+    async def invalidate(self, client_id: str):
+        """Call after deactivating a client or changing their subscription"""
+        self.local.pop(client_id, None)
+        redis_client = await self.get_redis()
+        await redis_client.delete(self._key(client_id))
+        await redis_client.publish(INVALIDATE_CHANNEL, client_id)
+
+    async def forget(self, client_id: str):
+        """Drop the local and Redis entries without a broadcast (every process gets the NOTIFY)"""
+        self.local.pop(client_id, None)
+        try:
+            redis_client = await self.get_redis()
+            await redis_client.delete(self._key(client_id))
+        except Exception:
+            pass
+
+    async def listen_client_changes(self, dsn: str):
+        """Evict principals on `client_changed` notifications; reconnects on failure"""
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn)
+                changed: asyncio.Queue = asyncio.Queue()
+                await conn.add_listener(CLIENT_CHANGED_CHANNEL, lambda *args: changed.put_nowait(args[-1]))
+                conn.add_termination_listener(lambda _: changed.put_nowait(None))
+                # Changes made while disconnected were missed
+                self.local.clear()
+                while True:
+                    client_id = await changed.get()
+                    if client_id is None:
+                        raise ConnectionError("listener connection closed")
+                    await self.forget(client_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Client change listener error, reconnecting: {e}")
+                await asyncio.sleep(5)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+    async def listen_invalidations(self):
+        """Evict local entries invalidated by any API process"""
+        redis_client = await self.get_stream_redis()
+        pubsub = redis_client.pubsub()
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self.local.pop(message["data"], None)
+        finally:
+            await pubsub.unsubscribe(INVALIDATE_CHANNEL)
+            await pubsub.aclose()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
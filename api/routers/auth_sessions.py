@@ -2,16 +2,20 @@
 Auth Sessions Router - VK Authorization via Browser
 """
 import json
-import asyncio
 from typing import Optional
-from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from database import get_db
+from database import settings, get_db, async_session, redis_client, redis_stream_client
+from task_queue import enqueue_task
+from session_codec import session_key, encode_session
+from auth_registry import AuthRegistry, OPEN_STATUSES
+
+SESSION_KEY = session_key(settings.session_secret)
+registry = AuthRegistry(redis_client, ttl=settings.auth_session_ttl)
 
 router = APIRouter(prefix="/auth-sessions", tags=["auth-sessions"])
 
@@ -39,10 +43,6 @@ class KeyPressRequest(BaseModel):
     key: str
 
 
-# In-memory auth sessions (in production, use Redis)
-auth_sessions = {}
-
-
 @router.post("", response_model=AuthSessionResponse)
 async def create_auth_session(
     request: CreateAuthSessionRequest,
@@ -64,19 +64,14 @@ async def create_auth_session(
     import uuid
     session_id = str(uuid.uuid4())
     
-    auth_sessions[session_id] = {
-        "vk_account_id": request.vk_account_id,
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat()
-    }
+    await registry.create(session_id, request.vk_account_id)
     
     # Send task to worker
-    from database import redis_client
-    await redis_client.lpush("auth_queue", json.dumps({
+    await enqueue_task(redis_client, {
         "type": "create_auth_session",
         "session_id": session_id,
         "vk_account_id": request.vk_account_id
-    }))
+    }, queue="auth_queue")
     
     return AuthSessionResponse(
         session_id=session_id,
@@ -88,7 +83,7 @@ async def create_auth_session(
 @router.get("/{session_id}")
 async def get_auth_session(session_id: str):
     """Get auth session status"""
-    session = auth_sessions.get(session_id)
+    session = await registry.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
@@ -97,7 +92,6 @@ async def get_auth_session(session_id: str):
 @router.post("/{session_id}/click")
 async def click_in_session(session_id: str, request: MouseClickRequest):
     """Send mouse click to auth session"""
-    from database import redis_client
     await redis_client.publish(f"auth_control:{session_id}", json.dumps({
         "action": "click",
         "x": request.x,
@@ -109,7 +103,6 @@ async def click_in_session(session_id: str, request: MouseClickRequest):
 @router.post("/{session_id}/type")
 async def type_in_session(session_id: str, request: TypeTextRequest):
     """Send text input to auth session"""
-    from database import redis_client
     await redis_client.publish(f"auth_control:{session_id}", json.dumps({
         "action": "type",
         "text": request.text
@@ -120,7 +113,6 @@ async def type_in_session(session_id: str, request: TypeTextRequest):
 @router.post("/{session_id}/key")
 async def press_key_in_session(session_id: str, request: KeyPressRequest):
     """Send key press to auth session"""
-    from database import redis_client
     await redis_client.publish(f"auth_control:{session_id}", json.dumps({
         "action": "key",
         "key": request.key
@@ -129,69 +121,66 @@ async def press_key_in_session(session_id: str, request: KeyPressRequest):
 
 
 @router.post("/{session_id}/complete")
-async def complete_auth_session(
-    session_id: str,
-    db: AsyncSession = Depends(get_db)
-):
+async def complete_auth_session(session_id: str):
     """
     Complete auth session - save cookies and close browser.
+    Waits for the worker's result with BLPOP; the DB session is opened only once it arrives.
     """
-    session = auth_sessions.get(session_id)
+    session = await registry.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    from database import redis_client
+    if not await registry.set_status(session_id, "completing", expect=OPEN_STATUSES):
+        raise HTTPException(status_code=409, detail="Session is already being completed or closed")
     
     # Request session data from worker
     await redis_client.publish(f"auth_control:{session_id}", json.dumps({
         "action": "complete"
     }))
     
-    # Wait for session data (with timeout)
-    for _ in range(30):  # 30 second timeout
-        await asyncio.sleep(1)
-        result = await redis_client.get(f"auth_result:{session_id}")
-        if result:
-            data = json.loads(result)
-            
-            if data.get("success"):
-                # Save session to database
-                session_data = json.dumps(data["session_data"]).encode()
-                await db.execute(
-                    text("""
-                        UPDATE vk_accounts 
-                        SET session_data_encrypted = :session_data,
-                            status = 'active',
-                            error_message = NULL,
-                            updated_at = NOW()
-                        WHERE id = :id
-                    """),
-                    {
-                        "id": session["vk_account_id"],
-                        "session_data": session_data
-                    }
-                )
-                await db.commit()
-                
-                # Cleanup
-                del auth_sessions[session_id]
-                await redis_client.delete(f"auth_result:{session_id}")
-                
-                return {"status": "completed", "message": "VK account authorized successfully"}
-            else:
-                raise HTTPException(status_code=400, detail=data.get("error", "Authorization failed"))
+    # Blocking wait on the stream pool - it must not hold a connection regular requests need
+    popped = await redis_stream_client.blpop(f"auth_result:{session_id}", timeout=settings.auth_complete_timeout)
+    if not popped:
+        await registry.set_status(session_id, "failed", error="Authorization timeout")
+        raise HTTPException(status_code=408, detail="Authorization timeout")
+    
+    data = json.loads(popped[1])
+    if not data.get("success"):
+        error = data.get("error", "Authorization failed")
+        await registry.set_status(session_id, "failed", error=error)
+        raise HTTPException(status_code=400, detail=error)
+    
+    # Save session to database
+    session_data = encode_session(data["session_data"], session["vk_account_id"], SESSION_KEY)
+    async with async_session() as db:
+        await db.execute(
+            text("""
+                UPDATE vk_accounts 
+                SET session_data_encrypted = :session_data,
+                    status = 'active',
+                    error_message = NULL,
+                    updated_at = NOW()
+                WHERE id = :id
+            """),
+            {
+                "id": session["vk_account_id"],
+                "session_data": session_data
+            }
+        )
+        await db.commit()
     
-    raise HTTPException(status_code=408, detail="Authorization timeout")
+    await registry.set_status(session_id, "completed")
+    
+    return {"status": "completed", "message": "VK account authorized successfully"}
 
 
 @router.delete("/{session_id}")
 async def cancel_auth_session(session_id: str):
     """Cancel and close auth session"""
-    session = auth_sessions.pop(session_id, None)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    if not await registry.set_status(session_id, "cancelled", expect=OPEN_STATUSES):
+        if not await registry.get(session_id):
+            raise HTTPException(status_code=404, detail="Session not found")
+        raise HTTPException(status_code=409, detail="Session is already being completed or closed")
     
-    from database import redis_client
     await redis_client.publish(f"auth_control:{session_id}", json.dumps({
         "action": "cancel"
     }))
@@ -7,6 +7,8 @@ from typing import Dict
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from database import redis_client, redis_stream_client
+
 router = APIRouter()
 
 
@@ -48,12 +50,10 @@ async def auth_websocket(websocket: WebSocket, session_id: str):
     Streams screenshots and receives user input.
     """
     await manager.connect(session_id, websocket)
+    pubsub = redis_stream_client.pubsub()
     
     try:
-        from database import redis_client
-        
         # Subscribe to screenshots
-        pubsub = redis_client.pubsub()
         await pubsub.subscribe(f"auth_screen:{session_id}")
         
         async def receive_messages():
@@ -99,3 +99,5 @@ async def auth_websocket(websocket: WebSocket, session_id: str):
     finally:
         manager.disconnect(session_id)
         await pubsub.unsubscribe(f"auth_screen:{session_id}")
+        # Return the connection to the shared pool
+        await pubsub.aclose()
@@ -0,0 +1,90 @@
+"""
+VK session codec for vk_accounts.session_data_encrypted
+
+Playwright's storage_state() is pruned to VK cookies and localStorage,
+compressed with zstd and encrypted with AES-GCM. The account id is bound
+as associated data, so a blob cannot be replayed into another account's row.
+
+Format (version 1):
+    b"VS" | version (1 byte) | nonce (12 bytes) | AES-GCM(zstd(JSON))
+
+Legacy rows (uncompressed JSON) are still readable and get rewritten in
+the new format on the next save.
+Mirror of worker/session_codec.py - keep the two in sync.
+"""
+import os
+import json
+import time
+import hashlib
+from typing import Optional
+from urllib.parse import urlsplit
+
+import zstandard
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+MAGIC = b"VS"
+VERSION = 1
+NONCE_SIZE = 12
+ZSTD_LEVEL = 10
+
+# Domains VK Dating needs: VK itself and the mini app iframe
+SESSION_DOMAINS = ("vk.com", "vk.ru", "vkontakte.ru", "vk-apps.com")
+
+
+def session_key(secret: str) -> bytes:
+    """256-bit AES key from SESSION_SECRET"""
+    return hashlib.sha256(secret.encode()).digest()
+
+
+def _is_session_host(host: str) -> bool:
+    host = host.lstrip(".").lower()
+    return any(host == domain or host.endswith("." + domain) for domain in SESSION_DOMAINS)
+
+
+def prune_state(state: dict) -> dict:
+    """VK cookies and origins only, expired cookies dropped"""
+    now = time.time()
+    cookies = [
+        c for c in state.get("cookies", [])
+        if _is_session_host(c.get("domain", "")) and not (0 < c.get("expires", -1) < now)
+    ]
+    origins = [
+        o for o in state.get("origins", [])
+        if _is_session_host(urlsplit(o.get("origin", "")).hostname or "")
+    ]
+    return {"cookies": cookies, "origins": origins}
+
+
+def _header(version: int) -> bytes:
+    return MAGIC + bytes([version])
+
+
+def encode_session(state: dict, account_id: str, key: bytes) -> bytes:
+    header = _header(VERSION)
+    payload = json.dumps(prune_state(state), separators=(",", ":")).encode()
+    compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    nonce = os.urandom(NONCE_SIZE)
+    return header + nonce + AESGCM(key).encrypt(nonce, compressed, header + account_id.encode())
+
+
+def decode_session(blob: Optional[bytes], account_id: str, key: bytes) -> Optional[dict]:
+    """storage_state from a vk_accounts row. Raises ValueError on corrupt data or a wrong key"""
+    if not blob:
+        return None
+    blob = bytes(blob)
+    if not blob.startswith(MAGIC):
+        # Legacy format: uncompressed JSON
+        return json.loads(blob.decode())
+
+    version = blob[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"Unsupported session format version {version}")
+    header = _header(version)
+    nonce = blob[len(header):len(header) + NONCE_SIZE]
+    ciphertext = blob[len(header) + NONCE_SIZE:]
+    try:
+        compressed = AESGCM(key).decrypt(nonce, ciphertext, header + account_id.encode())
+    except InvalidTag:
+        raise ValueError("Session authentication failed: wrong key, account or tampered data")
+    return json.loads(zstandard.ZstdDecompressor().decompress(compressed))
@@ -0,0 +1,112 @@
+"""
+Task queue producer helpers
+
+Mirrors worker/task_queue.py: producers LPUSH into the queue list,
+workers move tasks into a per-worker processing list and ack them.
+Every task gets an id and attempt counter so retries and the
+dead-letter list (`<queue>:dead`) can be traced.
+
+route_task sends an account's task to the inbox of the worker that
+already holds its browser (`account_worker`), otherwise to the least
+loaded live worker by `worker_load` / `worker_capacity`. With no live
+workers the task goes to the shared queue.
+"""
+import json
+import uuid
+from typing import Optional
+
+
+async def enqueue_task(redis_client, task: dict, queue: str = "task_queue") -> str:
+    """Push a task onto the queue and return its id"""
+    task.setdefault("id", str(uuid.uuid4()))
+    task.setdefault("attempts", 0)
+    await redis_client.lpush(queue, json.dumps(task))
+    return task["id"]
+
+
+def worker_inbox(worker_id: str, queue: str = "task_queue") -> str:
+    return f"{queue}:inbox:{worker_id}"
+
+
+async def live_workers(redis_client, queue: str = "task_queue") -> list:
+    """Workers whose queue lease is still alive"""
+    workers = list(await redis_client.hkeys("worker_capacity"))
+    if not workers:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for worker_id in workers:
+            pipe.exists(f"{queue}:lease:{worker_id}")
+        alive = await pipe.execute()
+    return [w for w, ok in zip(workers, alive) if ok]
+
+
+async def pick_worker(redis_client, account_id: Optional[str], queue: str = "task_queue") -> Optional[str]:
+    """Worker already holding the account, otherwise the least loaded live worker"""
+    if account_id:
+        owner = await redis_client.hget("account_worker", account_id)
+        if owner and await redis_client.exists(f"{queue}:lease:{owner}"):
+            return owner
+
+    workers = await live_workers(redis_client, queue)
+    if not workers:
+        return None
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hmget("worker_load", workers)
+        pipe.hmget("worker_capacity", workers)
+        loads, capacities = await pipe.execute()
+
+    def utilization(item):
+        _, load, capacity = item
+        return int(load or 0) / max(1, int(capacity or 1))
+
+    candidates = list(zip(workers, loads, capacities))
+    free = [c for c in candidates if int(c[1] or 0) < int(c[2] or 1)]
+    worker_id = min(free or candidates, key=utilization)[0]
+
+    if account_id:
+        # Pin the account right away and count it until the worker reports again
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset("account_worker", account_id, worker_id)
+            pipe.hincrby("worker_load", worker_id, 1)
+            await pipe.execute()
+    return worker_id
+
+
+async def route_task(redis_client, task: dict, queue: str = "task_queue") -> str:
+    """Push a task to the inbox of the best worker (or the shared queue)"""
+    worker_id = await pick_worker(redis_client, task.get("vk_account_id"), queue)
+    target = worker_inbox(worker_id, queue) if worker_id else queue
+    return await enqueue_task(redis_client, task, target)
+
+
+async def queue_stats(redis_client, queue: str = "task_queue") -> dict:
+    """
+    Queue length (shared + worker inboxes), tasks being processed by workers,
+    pending retries and dead-lettered tasks - two round trips
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hkeys("worker_capacity")
+        pipe.smembers(f"{queue}:consumers")
+        workers, consumers = await pipe.execute()
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.llen(queue)
+        pipe.zcard(f"{queue}:delayed")
+        pipe.llen(f"{queue}:dead")
+        for worker_id in workers:
+            pipe.llen(worker_inbox(worker_id, queue))
+        for consumer_id in consumers:
+            pipe.llen(f"{queue}:processing:{consumer_id}")
+        shared, retrying, dead, *lengths = await pipe.execute()
+
+    inboxes = sum(lengths[:len(workers)])
+    return {
+        "queue_length": shared + inboxes,
+        "shared_length": shared,
+        "inbox_length": inboxes,
+        "workers": len(workers),
+        "processing": sum(lengths[len(workers):]),
+        "retrying": retrying,
+        "dead_letter": dead
+    }
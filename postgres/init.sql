@@ -50,19 +50,139 @@ CREATE TABLE IF NOT EXISTS bot_configs (
 CREATE INDEX IF NOT EXISTS idx_bot_configs_account ON bot_configs(vk_account_id);
 CREATE INDEX IF NOT EXISTS idx_bot_configs_active ON bot_configs(is_active) WHERE is_active = true;
 
+-- activity_log is range-partitioned by month on created_at.
+-- Partitions are created ahead and dropped after the retention period by
+-- manage_activity_log_partitions(), run by the scheduler at startup and daily.
+
+-- Migrate a pre-partitioning activity_log out of the way (copied back below)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'activity_log' AND relkind = 'r') THEN
+        ALTER TABLE activity_log RENAME TO activity_log_legacy;
+        ALTER TABLE activity_log_legacy RENAME CONSTRAINT activity_log_pkey TO activity_log_legacy_pkey;
+        DROP INDEX IF EXISTS idx_activity_log_created;
+        DROP INDEX IF EXISTS idx_activity_log_client;
+        DROP INDEX IF EXISTS idx_activity_log_client_created;
+        DROP TRIGGER IF EXISTS trigger_activity_log_stats ON activity_log_legacy;
+    END IF;
+END;
+$$;
+
 CREATE TABLE IF NOT EXISTS activity_log (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     client_id UUID REFERENCES clients(id),
     vk_account_id UUID REFERENCES vk_accounts(id),
     action_type VARCHAR(50) NOT NULL,
     target_profile JSONB,
     result VARCHAR(20),
     details JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows outside the managed range (e.g. migrated history)
+CREATE TABLE IF NOT EXISTS activity_log_default PARTITION OF activity_log DEFAULT;
 
 CREATE INDEX IF NOT EXISTS idx_activity_log_created ON activity_log(created_at);
-CREATE INDEX IF NOT EXISTS idx_activity_log_client ON activity_log(client_id);
+CREATE INDEX IF NOT EXISTS idx_activity_log_client_created ON activity_log(client_id, created_at);
+
+-- Signature gained p_from; drop the old overload so calls stay unambiguous
+DROP FUNCTION IF EXISTS manage_activity_log_partitions(INTERVAL, INT);
+
+CREATE OR REPLACE FUNCTION manage_activity_log_partitions(
+    p_retention INTERVAL DEFAULT INTERVAL '180 days',
+    p_months_ahead INT DEFAULT 2,
+    p_from DATE DEFAULT NULL
+) RETURNS VOID AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    last_month DATE;
+    oldest DATE;
+    part_name TEXT;
+    part RECORD;
+BEGIN
+    -- Rows past retention in DEFAULT are not worth a partition
+    DELETE FROM activity_log_default WHERE created_at < NOW() - p_retention;
+
+    -- Cover every month from the oldest row still in DEFAULT (or p_from) up to p_months_ahead
+    SELECT date_trunc('month', MIN(created_at))::date INTO oldest FROM activity_log_default;
+    month_start := date_trunc('month', CURRENT_DATE)::date;
+    last_month := (month_start + make_interval(months => p_months_ahead))::date;
+    month_start := LEAST(
+        month_start,
+        COALESCE(oldest, month_start),
+        GREATEST(COALESCE(date_trunc('month', p_from)::date, month_start), date_trunc('month', NOW() - p_retention)::date)
+    );
+
+    WHILE month_start <= last_month LOOP
+        month_end := (month_start + INTERVAL '1 month')::date;
+        part_name := 'activity_log_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(part_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM activity_log_default WHERE created_at >= month_start AND created_at < month_end) THEN
+                -- A plain PARTITION OF would fail while DEFAULT holds rows of this month:
+                -- move them into a standalone table, then attach it. Inserting into the
+                -- table directly (not via the parent) keeps the stats triggers from counting them twice.
+                EXECUTE format('CREATE TABLE %I (LIKE activity_log INCLUDING DEFAULTS)', part_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM activity_log_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, part_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE activity_log ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part_name, month_start, month_end
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF activity_log FOR VALUES FROM (%L) TO (%L)',
+                    part_name, month_start, month_end
+                );
+            END IF;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+
+    -- Retention is a partition drop, not a DELETE
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits inh
+        JOIN pg_class c ON c.oid = inh.inhrelid
+        WHERE inh.inhparent = 'activity_log'::regclass
+          AND c.relname ~ '^activity_log_[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(right(part.relname, 7), 'YYYY_MM') + INTERVAL '1 month' <= NOW() - p_retention THEN
+            EXECUTE format('DROP TABLE IF EXISTS %I', part.relname);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT manage_activity_log_partitions();
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'activity_log_legacy' AND relkind = 'r') THEN
+        -- Monthly partitions for the legacy history first, so it never lands in DEFAULT
+        PERFORM manage_activity_log_partitions(p_from => (SELECT MIN(created_at) FROM activity_log_legacy)::date);
+        INSERT INTO activity_log (id, client_id, vk_account_id, action_type, target_profile, result, details, created_at)
+        SELECT id, client_id, vk_account_id, action_type, target_profile, result, details, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM activity_log_legacy;
+        PERFORM setval(pg_get_serial_sequence('activity_log', 'id'), COALESCE((SELECT MAX(id) FROM activity_log), 1));
+        DROP TABLE activity_log_legacy;
+    END IF;
+END;
+$$;
+
+-- Per-client counters for /stats, maintained by triggers below
+CREATE TABLE IF NOT EXISTS client_daily_stats (
+    client_id UUID NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    action_type VARCHAR(50) NOT NULL,
+    total INT NOT NULL DEFAULT 0,
+    success INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, day, action_type)
+);
 
 CREATE TABLE IF NOT EXISTS dialogues (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -81,6 +201,14 @@ CREATE TABLE IF NOT EXISTS dialogues (
 
 CREATE INDEX IF NOT EXISTS idx_dialogues_client ON dialogues(client_id);
 CREATE INDEX IF NOT EXISTS idx_dialogues_outcome ON dialogues(outcome);
+-- One dialogue per person per account; the worker's match check upserts on it
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dialogues_account_profile ON dialogues(vk_account_id, (target_profile->>'fingerprint'));
+
+CREATE TABLE IF NOT EXISTS client_stats (
+    client_id UUID PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE,
+    active_dialogues INT NOT NULL DEFAULT 0,
+    completed_quests INT NOT NULL DEFAULT 0
+);
 
 CREATE TABLE IF NOT EXISTS dialogue_patterns (
     id BIGSERIAL PRIMARY KEY,
@@ -108,9 +236,93 @@ $$ LANGUAGE plpgsql;
 DROP TRIGGER IF EXISTS trigger_clients_updated_at ON clients;
 CREATE TRIGGER trigger_clients_updated_at BEFORE UPDATE ON clients FOR EACH ROW EXECUTE FUNCTION update_updated_at();
 
+-- The API caches authenticated clients (principal cache) and evicts them on this notification
+CREATE OR REPLACE FUNCTION notify_client_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('client_changed', COALESCE(NEW.id, OLD.id)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_clients_notify ON clients;
+CREATE TRIGGER trigger_clients_notify AFTER UPDATE OR DELETE ON clients FOR EACH ROW EXECUTE FUNCTION notify_client_changed();
+
 DROP TRIGGER IF EXISTS trigger_vk_accounts_updated_at ON vk_accounts;
 CREATE TRIGGER trigger_vk_accounts_updated_at BEFORE UPDATE ON vk_accounts FOR EACH ROW EXECUTE FUNCTION update_updated_at();
 
+-- activity_log -> client_daily_stats: one aggregated upsert per INSERT/COPY statement, not per row
+CREATE OR REPLACE FUNCTION aggregate_activity_stats() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO client_daily_stats (client_id, day, action_type, total, success)
+    SELECT client_id, created_at::date, action_type, COUNT(*), COUNT(*) FILTER (WHERE result = 'success')
+    FROM new_activity
+    WHERE client_id IS NOT NULL
+    GROUP BY client_id, created_at::date, action_type
+    ON CONFLICT (client_id, day, action_type) DO UPDATE
+    SET total = client_daily_stats.total + EXCLUDED.total,
+        success = client_daily_stats.success + EXCLUDED.success;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_activity_log_stats ON activity_log;
+CREATE TRIGGER trigger_activity_log_stats AFTER INSERT ON activity_log
+    REFERENCING NEW TABLE AS new_activity
+    FOR EACH STATEMENT EXECUTE FUNCTION aggregate_activity_stats();
+
+-- dialogues -> client_stats
+CREATE OR REPLACE FUNCTION bump_client_stats(p_client_id UUID, p_active INT, p_completed INT) RETURNS VOID AS $$
+BEGIN
+    IF p_client_id IS NULL OR (p_active = 0 AND p_completed = 0) THEN
+        RETURN;
+    END IF;
+    INSERT INTO client_stats (client_id, active_dialogues, completed_quests)
+    VALUES (p_client_id, p_active, p_completed)
+    ON CONFLICT (client_id) DO UPDATE
+    SET active_dialogues = client_stats.active_dialogues + EXCLUDED.active_dialogues,
+        completed_quests = client_stats.completed_quests + EXCLUDED.completed_quests;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_dialogue_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_client_stats(
+            OLD.client_id,
+            -(OLD.outcome IS NULL)::int,
+            -(COALESCE(OLD.outcome = 'goal_reached', false))::int
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_client_stats(
+            NEW.client_id,
+            (NEW.outcome IS NULL)::int,
+            (COALESCE(NEW.outcome = 'goal_reached', false))::int
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_dialogues_stats ON dialogues;
+CREATE TRIGGER trigger_dialogues_stats AFTER INSERT OR DELETE OR UPDATE OF outcome, client_id ON dialogues
+    FOR EACH ROW EXECUTE FUNCTION count_dialogue_stats();
+
+-- Backfill counters for existing data
+INSERT INTO client_daily_stats (client_id, day, action_type, total, success)
+SELECT client_id, created_at::date, action_type, COUNT(*), COUNT(*) FILTER (WHERE result = 'success')
+FROM activity_log
+WHERE client_id IS NOT NULL
+GROUP BY client_id, created_at::date, action_type
+ON CONFLICT DO NOTHING;
+
+INSERT INTO client_stats (client_id, active_dialogues, completed_quests)
+SELECT client_id, COUNT(*) FILTER (WHERE outcome IS NULL), COUNT(*) FILTER (WHERE outcome = 'goal_reached')
+FROM dialogues
+WHERE client_id IS NOT NULL
+GROUP BY client_id
+ON CONFLICT DO NOTHING;
+
 INSERT INTO dialogue_patterns (girl_type, stage, her_message_keywords, our_message) VALUES
 ('any', 'opener', '{}', 'Привет! Заметил тебя в ленте, интересный профиль'),
 ('any', 'opener', '{}', 'Привет! Как твой день проходит?'),
@@ -35,7 +35,10 @@ services:
       - DATABASE_URL=\${DATABASE_URL}
       - REDIS_URL=redis://:${REDIS_PASSWORD}@${MAIN_SERVER_IP}:6379/0
       - MAX_BROWSERS=\${MAX_BROWSERS:-8}
+      - SHARED_BROWSERS=\${SHARED_BROWSERS:-true}
+      - BROWSER_PROCESSES=\${BROWSER_PROCESSES:-2}
       - WORKER_ID=$WORKER_ID
+      - SESSION_SECRET=\${SESSION_SECRET}
     shm_size: '2gb'
     deploy:
       resources:
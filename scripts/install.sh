@@ -65,6 +65,7 @@ if [ ! -f .env ]; then
     cp .env.example .env
     sed -i "s/REDIS_PASSWORD=.*/REDIS_PASSWORD=$(openssl rand -base64 32 | tr -dc 'a-zA-Z0-9' | head -c 32)/" .env
     sed -i "s/JWT_SECRET=.*/JWT_SECRET=$(openssl rand -base64 64 | tr -dc 'a-zA-Z0-9' | head -c 64)/" .env
+    sed -i "s/SESSION_SECRET=.*/SESSION_SECRET=$(openssl rand -base64 64 | tr -dc 'a-zA-Z0-9' | head -c 64)/" .env
     sed -i "s/GRAFANA_PASSWORD=.*/GRAFANA_PASSWORD=$(openssl rand -base64 16 | tr -dc 'a-zA-Z0-9' | head -c 16)/" .env
     chmod 600 .env
 fi
@@ -0,0 +1,116 @@
+"""
+Отложенная запись состояния аккаунтов (write-behind)
+
+Статусы, ошибки, last_active_at и сессии аккаунтов копятся в памяти воркера
+и раз в несколько секунд пишутся в vk_accounts одним
+UPDATE ... FROM (VALUES ...). По каждому аккаунту побеждает последнее состояние:
+десять смен статуса между сбросами - одна строка в пачке.
+После записи смены статусов публикуются в канал account_status
+(планировщик держит по ним список активных аккаунтов).
+"""
+import json
+import asyncio
+import logging
+from typing import Dict
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_STATUS_CHANNEL = "account_status"
+
+
+def _merge(older: dict, newer: dict) -> dict:
+    merged = dict(older)
+    merged.update(newer)
+    return merged
+
+
+class AccountStateBuffer:
+    def __init__(self, session_factory, flush_interval: float = 3.0, redis_client=None):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.redis = redis_client
+        # account_id -> {"status", "error", "touch", "session"}; touch - last_active_at = NOW() в БД
+        self.pending: Dict[str, dict] = {}
+        self.running = True
+        self.lock = asyncio.Lock()
+
+    def _update(self, account_id: str, **fields):
+        self.pending[account_id] = _merge(self.pending.get(account_id, {}), fields)
+
+    def set_status(self, account_id: str, status: str, error: str = None):
+        """Статус аккаунта; error_message перезаписывается (None - очищается)"""
+        self._update(account_id, status=status, error=error, touch=True)
+
+    def heartbeat(self, account_id: str):
+        # Время ставит БД: cleanup_stale_sessions сравнивает с NOW() в её часовом поясе
+        self._update(account_id, touch=True)
+
+    def save_session(self, account_id: str, session: bytes):
+        self._update(account_id, session=session)
+
+    async def flush(self) -> int:
+        async with self.lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+
+            rows = []
+            params = {}
+            for i, (account_id, state) in enumerate(batch.items()):
+                rows.append(
+                    f"(CAST(:id{i} AS uuid), CAST(:status{i} AS varchar), CAST(:error{i} AS text), "
+                    f"CAST(:touch{i} AS boolean), CAST(:session{i} AS bytea))"
+                )
+                params[f"id{i}"] = account_id
+                params[f"status{i}"] = state.get("status")
+                params[f"error{i}"] = state.get("error")
+                params[f"touch{i}"] = bool(state.get("touch"))
+                params[f"session{i}"] = state.get("session")
+
+            # NULL в VALUES - "не менять"; error_message меняется только вместе со статусом
+            query = f"""
+                UPDATE vk_accounts AS va SET
+                    status = COALESCE(v.status, va.status),
+                    error_message = CASE WHEN v.status IS NULL THEN va.error_message ELSE v.error END,
+                    last_active_at = CASE WHEN v.touch THEN NOW() ELSE va.last_active_at END,
+                    session_data_encrypted = COALESCE(v.session, va.session_data_encrypted)
+                FROM (VALUES {", ".join(rows)}) AS v(id, status, error, touch, session)
+                WHERE va.id = v.id
+            """
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(text(query), params)
+                    await db.commit()
+            except Exception as e:
+                logger.error(f"Account state flush error ({len(batch)} accounts kept): {e}")
+                # Состояние, пришедшее во время сброса, новее неудавшейся пачки
+                for account_id, state in batch.items():
+                    self.pending[account_id] = _merge(state, self.pending.get(account_id, {}))
+                return 0
+
+            await self._publish_statuses(batch)
+            return len(batch)
+
+    async def _publish_statuses(self, batch: Dict[str, dict]):
+        statuses = {a: s["status"] for a, s in batch.items() if s.get("status")}
+        if not self.redis or not statuses:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for account_id, status in statuses.items():
+                    pipe.publish(ACCOUNT_STATUS_CHANNEL, json.dumps({"id": account_id, "status": status}))
+                await pipe.execute()
+        except Exception as e:
+            # Планировщик догонит по контрольной сумме
+            logger.warning(f"Account status publish error: {e}")
+
+    async def run(self):
+        while self.running:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        self.running = False
+        await self.flush()
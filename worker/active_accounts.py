@@ -0,0 +1,122 @@
+"""
+Активные аккаунты планировщика в памяти
+
+Полный список (bot_configs.is_active = true) загружается один раз, дальше
+поддерживается событиями:
+    control:<аккаунт>  start / reload_config / stop   (API)
+    account_status     {"id": ..., "status": ...}     (воркеры, после записи в БД)
+Раз в несколько минут сверяется с БД по контрольной сумме - один агрегат
+вместо выгрузки строк; при расхождении список перечитывается целиком.
+"""
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_STATUS_CHANNEL = "account_status"
+
+ACCOUNTS_QUERY = """
+    SELECT bc.vk_account_id, va.status, bc.swipe_interval_minutes, bc.boost_times, bc.boost_timezone
+    FROM bot_configs bc JOIN vk_accounts va ON bc.vk_account_id = va.id
+    WHERE bc.is_active = true
+"""
+
+# Та же строка на аккаунт, что и ActiveAccount.checksum_line, в порядке uuid
+CHECKSUM_QUERY = """
+    SELECT COUNT(*) AS total, md5(COALESCE(string_agg(
+        bc.vk_account_id::text || ':' || COALESCE(va.status, '') || ':' || COALESCE(bc.swipe_interval_minutes, 0)
+            || ':' || COALESCE(array_to_string(bc.boost_times, ','), '') || ':' || COALESCE(bc.boost_timezone, ''),
+        '|' ORDER BY bc.vk_account_id
+    ), '')) AS digest
+    FROM bot_configs bc JOIN vk_accounts va ON bc.vk_account_id = va.id
+    WHERE bc.is_active = true
+"""
+
+
+@dataclass
+class ActiveAccount:
+    id: str
+    status: Optional[str]
+    swipe_interval_minutes: Optional[int]
+    boost_times: Optional[List[str]]
+    boost_timezone: Optional[str]
+
+    @classmethod
+    def from_row(cls, row) -> "ActiveAccount":
+        return cls(
+            id=str(row.vk_account_id),
+            status=row.status,
+            swipe_interval_minutes=row.swipe_interval_minutes,
+            boost_times=list(row.boost_times) if row.boost_times is not None else None,
+            boost_timezone=row.boost_timezone
+        )
+
+    def checksum_line(self) -> str:
+        return ":".join([
+            self.id,
+            self.status or "",
+            str(self.swipe_interval_minutes or 0),
+            ",".join(self.boost_times or []),
+            self.boost_timezone or ""
+        ])
+
+
+class ActiveAccounts:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.accounts: Dict[str, ActiveAccount] = {}
+        self.reloads = 0
+
+    async def load(self):
+        async with self.session_factory() as db:
+            result = await db.execute(text(ACCOUNTS_QUERY))
+            self.accounts = {a.id: a for a in map(ActiveAccount.from_row, result.fetchall())}
+        self.reloads += 1
+        logger.info(f"👥 Loaded {len(self.accounts)} active accounts")
+
+    async def refresh(self, account_id: str) -> Optional[ActiveAccount]:
+        """Перечитывает один аккаунт (после start / reload_config)"""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                text(ACCOUNTS_QUERY + " AND bc.vk_account_id = :account_id"),
+                {"account_id": account_id}
+            )
+            row = result.fetchone()
+        if row is None:
+            self.accounts.pop(account_id, None)
+            return None
+        account = ActiveAccount.from_row(row)
+        self.accounts[account_id] = account
+        return account
+
+    def remove(self, account_id: str):
+        self.accounts.pop(account_id, None)
+
+    async def set_status(self, account_id: str, status: str) -> Optional[ActiveAccount]:
+        account = self.accounts.get(account_id)
+        if account is None:
+            # Аккаунт мог быть включён, пока событие start не дошло
+            return await self.refresh(account_id)
+        account.status = status
+        return account
+
+    def checksum(self) -> tuple:
+        lines = [self.accounts[a].checksum_line() for a in sorted(self.accounts)]
+        return len(lines), hashlib.md5("|".join(lines).encode()).hexdigest()
+
+    async def reconcile(self) -> bool:
+        """Сверка с БД; True - если расходились и список перечитан"""
+        async with self.session_factory() as db:
+            row = (await db.execute(text(CHECKSUM_QUERY))).fetchone()
+        if (row.total, row.digest) == self.checksum():
+            return False
+        logger.warning(f"👥 Active accounts drifted ({len(self.accounts)} in memory, {row.total} in DB), reloading")
+        await self.load()
+        return True
+
+    def with_status(self, *statuses: str) -> List[ActiveAccount]:
+        return [a for a in self.accounts.values() if a.status in statuses]
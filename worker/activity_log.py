@@ -0,0 +1,125 @@
+"""
+Пакетная запись в activity_log через COPY
+
+Одна команда COPY на пачку строк вместо INSERT на каждое действие.
+Статистика /stats обновляется триггером на уровне оператора (см. postgres/init.sql),
+поэтому на пачку приходится один агрегирующий upsert.
+"""
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Iterable, List
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_COLUMNS = ["client_id", "vk_account_id", "action_type", "target_profile", "result", "details", "created_at"]
+
+
+def _record(entry: dict) -> tuple:
+    target_profile = entry.get("target_profile")
+    details = entry.get("details")
+    return (
+        entry.get("client_id"),
+        entry.get("vk_account_id"),
+        entry["action_type"],
+        json.dumps(target_profile, ensure_ascii=False, default=str) if target_profile is not None else None,
+        entry.get("result"),
+        json.dumps(details, ensure_ascii=False, default=str) if details is not None else None,
+        entry.get("created_at") or datetime.utcnow()
+    )
+
+
+async def copy_activity(engine, entries: Iterable[dict]) -> int:
+    """Записывает строки activity_log одним COPY. Возвращает число строк"""
+    records: List[tuple] = [_record(e) for e in entries]
+    if not records:
+        return 0
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "activity_log",
+            records=records,
+            columns=ACTIVITY_COLUMNS
+        )
+    return len(records)
+
+
+def is_data_error(error: Exception) -> bool:
+    """Ошибка в самих строках (классы SQLSTATE 22 и 23) - повтор той же пачки не поможет"""
+    return isinstance(error, (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError))
+
+
+class ActivityBuffer:
+    """
+    Буфер действий ботов в памяти воркера.
+    Сбрасывается в activity_log пачкой по размеру или по интервалу, а также при остановке.
+    При недоступности БД строки остаются в буфере (не больше max_pending, старые отбрасываются).
+    Если COPY отвергает данные (например, FK на удалённый аккаунт), пачка делится пополам,
+    пока плохие строки не найдутся; они логируются и отбрасываются, остальные записываются.
+    """
+    
+    def __init__(self, engine, batch_size: int = 200, flush_interval: float = 5.0, max_pending: int = 10000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.entries: List[dict] = []
+        self.dropped = 0
+        self.rejected = 0
+        self.running = True
+        self.lock = asyncio.Lock()
+        self.flush_requested = asyncio.Event()
+    
+    def add(self, entry: dict):
+        entry.setdefault("created_at", datetime.utcnow())
+        self.entries.append(entry)
+        if len(self.entries) > self.max_pending:
+            overflow = len(self.entries) - self.max_pending
+            del self.entries[:overflow]
+            self.dropped += overflow
+        if len(self.entries) >= self.batch_size:
+            self.flush_requested.set()
+    
+    async def flush(self) -> int:
+        async with self.lock:
+            if not self.entries:
+                return 0
+            batch, self.entries = self.entries, []
+            written = 0
+            chunks = [batch]
+            while chunks:
+                chunk = chunks.pop()
+                try:
+                    written += await copy_activity(self.engine, chunk)
+                except Exception as e:
+                    if not is_data_error(e):
+                        unwritten = [entry for c in [chunk] + chunks[::-1] for entry in c]
+                        logger.error(f"Activity flush error ({len(unwritten)} rows kept): {e}")
+                        self.entries = (unwritten + self.entries)[-self.max_pending:]
+                        return written
+                    if len(chunk) == 1:
+                        self.rejected += 1
+                        logger.error(f"Activity row rejected and dropped: {e} ({chunk[0].get('action_type')}, "
+                                     f"account {chunk[0].get('vk_account_id')})")
+                        continue
+                    middle = len(chunk) // 2
+                    # Первая половина - сверху стека, порядок строк сохраняется
+                    chunks += [chunk[middle:], chunk[:middle]]
+            return written
+    
+    async def run(self):
+        while self.running:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+    
+    async def close(self):
+        self.running = False
+        self.flush_requested.set()
+        await self.flush()
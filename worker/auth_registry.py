@@ -0,0 +1,94 @@
+"""
+Реестр сессий авторизации в Redis
+
+Каждая сессия входа в VK - хеш `auth_session:<id>`
+(vk_account_id, status, created_at, updated_at, error) с TTL: все процессы
+API и auth-воркер видят одно и то же состояние, рестарт ничего не теряет.
+TTL продлевается при каждой смене статуса, брошенные сессии истекают сами.
+
+Смена статуса - compare-and-set на Lua: переход применяется, только пока
+сессия существует и её статус среди ожидаемых, поэтому гонка /complete
+и DELETE из разных процессов API не может выиграть дважды.
+
+Статусы: pending -> ready -> completing -> completed | failed,
+pending | ready -> cancelled.
+Копия модуля лежит в api/auth_registry.py - менять вместе.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+
+KEY_PREFIX = "auth_session:"
+OPEN_STATUSES = ("pending", "ready")
+
+# KEYS[1] - хеш сессии; ARGV: ttl, ожидаемые статусы ("" - любой), дальше пары поле/значение.
+# Возвращает прежний статус или false, если сессии нет или статус другой.
+SET_STATUS = """
+local current = redis.call('HGET', KEYS[1], 'status')
+if not current then
+    return false
+end
+if ARGV[2] ~= '' then
+    local allowed = false
+    for status in string.gmatch(ARGV[2], '[^,]+') do
+        if status == current then
+            allowed = true
+            break
+        end
+    end
+    if not allowed then
+        return false
+    end
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return current
+"""
+
+
+def registry_key(session_id: str) -> str:
+    return KEY_PREFIX + session_id
+
+
+class AuthRegistry:
+    def __init__(self, redis_client, ttl: int = 900):
+        self.redis = redis_client
+        self.ttl = ttl
+        self._set_status = redis_client.register_script(SET_STATUS)
+
+    async def create(self, session_id: str, vk_account_id: str) -> dict:
+        now = datetime.utcnow().isoformat()
+        session = {
+            "vk_account_id": vk_account_id,
+            "status": "pending",
+            "created_at": now,
+            "updated_at": now
+        }
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(registry_key(session_id), mapping=session)
+            pipe.expire(registry_key(session_id), self.ttl)
+            await pipe.execute()
+        return session
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        session = await self.redis.hgetall(registry_key(session_id))
+        return session or None
+
+    async def set_status(
+        self,
+        session_id: str,
+        status: str,
+        expect: Optional[Iterable[str]] = None,
+        **fields: str
+    ) -> Optional[str]:
+        """Атомарный переход; возвращает прежний статус или None, если переход не применён"""
+        args = [self.ttl, ",".join(expect or ()), "status", status,
+                "updated_at", datetime.utcnow().isoformat()]
+        for name, value in fields.items():
+            args += [name, "" if value is None else str(value)]
+        previous = await self._set_status(keys=[registry_key(session_id)], args=args)
+        return previous if previous else None
+
+    async def delete(self, session_id: str):
+        await self.redis.delete(registry_key(session_id))
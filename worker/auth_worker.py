@@ -12,6 +12,8 @@ import redis.asyncio as redis
 from pydantic_settings import BaseSettings
 
 from auth_service import AuthManager, AuthSession
+from task_queue import ReliableQueue
+from auth_registry import AuthRegistry
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,6 +25,10 @@ logger = logging.getLogger(__name__)
 class Settings(BaseSettings):
     redis_url: str = "redis://redis:6379"
     screenshot_interval: float = 0.5  # seconds
+    worker_id: str = "auth-worker-1"
+    task_visibility_timeout: int = 120  # seconds
+    task_max_attempts: int = 3
+    auth_session_ttl: int = 900  # seconds, same as in the API
     
     class Config:
         env_file = ".env"
@@ -35,11 +41,22 @@ class AuthWorker:
     def __init__(self):
         self.auth_manager = AuthManager()
         self.redis_client = None
+        self.auth_queue: Optional[ReliableQueue] = None
+        self.registry: Optional[AuthRegistry] = None
         self.running = True
         self.screenshot_tasks: Dict[str, asyncio.Task] = {}
     
     async def start(self):
         self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+        self.auth_queue = ReliableQueue(
+            self.redis_client,
+            "auth_queue",
+            settings.worker_id,
+            visibility_timeout=settings.task_visibility_timeout,
+            max_attempts=settings.task_max_attempts
+        )
+        await self.auth_queue.register()
+        self.registry = AuthRegistry(self.redis_client, ttl=settings.auth_session_ttl)
         logger.info("Auth worker started")
     
     async def stop(self):
@@ -48,19 +65,21 @@ class AuthWorker:
             task.cancel()
         for session_id in list(self.auth_manager.sessions.keys()):
             await self.auth_manager.close_session(session_id)
+        if self.auth_queue:
+            await self.auth_queue.requeue_inflight()
         if self.redis_client:
             await self.redis_client.close()
     
     async def process_auth_queue(self):
         """Process auth session creation requests"""
         while self.running:
+            result = None
             try:
-                result = await self.redis_client.brpop("auth_queue", timeout=5)
+                result = await self.auth_queue.get(timeout=5)
                 if not result:
                     continue
                 
-                _, task_json = result
-                task = json.loads(task_json)
+                raw, task = result
                 
                 if task["type"] == "create_auth_session":
                     session_id = task["session_id"]
@@ -78,6 +97,13 @@ class AuthWorker:
                         await session.navigate_to_vk_login()
                         self.auth_manager.sessions[session_id] = session
                     
+                    # Session may have been cancelled or expired while the browser was starting
+                    if not await self.registry.set_status(session_id, "ready", expect=("pending",)):
+                        await self.auth_manager.close_session(session_id)
+                        logger.info(f"Auth session {session_id} is no longer pending, browser closed")
+                        await self.auth_queue.ack(raw)
+                        continue
+                    
                     # Start screenshot streaming
                     self.screenshot_tasks[session_id] = asyncio.create_task(
                         self._stream_screenshots(session_id)
@@ -87,11 +113,28 @@ class AuthWorker:
                     asyncio.create_task(self._listen_control(session_id))
                     
                     logger.info(f"Auth session {session_id} created for account {account_id}")
+                
+                await self.auth_queue.ack(raw)
                     
             except Exception as e:
                 logger.error(f"Auth queue error: {e}")
+                if result:
+                    try:
+                        await self.auth_queue.fail(*result, str(e))
+                    except Exception as fail_error:
+                        logger.error(f"Auth queue retry error: {fail_error}")
                 await asyncio.sleep(1)
     
+    async def maintain_queue(self):
+        """Keep the worker lease alive, promote retries, reclaim tasks of dead workers"""
+        interval = max(5, settings.task_visibility_timeout // 3)
+        while self.running:
+            try:
+                await self.auth_queue.maintain()
+            except Exception as e:
+                logger.error(f"Auth queue maintenance error: {e}")
+            await asyncio.sleep(interval)
+    
     async def _stream_screenshots(self, session_id: str):
         """Stream screenshots to Redis for WebSocket clients"""
         while self.running:
@@ -141,17 +184,15 @@ class AuthWorker:
                     
                     if is_logged_in:
                         session_data = await session.get_session_data()
-                        await self.redis_client.set(
-                            f"auth_result:{session_id}",
-                            json.dumps({"success": True, "session_data": session_data}),
-                            ex=60  # 1 minute TTL
-                        )
+                        result = {"success": True, "session_data": session_data}
                     else:
-                        await self.redis_client.set(
-                            f"auth_result:{session_id}",
-                            json.dumps({"success": False, "error": "Not logged in to VK"}),
-                            ex=60
-                        )
+                        result = {"success": False, "error": "Not logged in to VK"}
+                    
+                    # API waits on this list with BLPOP and wakes up immediately
+                    async with self.redis_client.pipeline(transaction=True) as pipe:
+                        pipe.lpush(f"auth_result:{session_id}", json.dumps(result))
+                        pipe.expire(f"auth_result:{session_id}", 60)  # 1 minute TTL
+                        await pipe.execute()
                     
                     # Cleanup
                     await self._cleanup_session(session_id)
@@ -180,7 +221,10 @@ async def main():
     worker = AuthWorker()
     try:
         await worker.start()
-        await worker.process_auth_queue()
+        await asyncio.gather(
+            worker.process_auth_queue(),
+            worker.maintain_queue()
+        )
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     finally:
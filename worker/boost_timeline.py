@@ -0,0 +1,169 @@
+"""
+Таймлайн бустов
+
+Вместо сканирования всех bot_configs каждые 5 минут для каждого аккаунта
+заранее вычисляется ближайший момент буста в его boost_timezone и кладётся
+в ZSET `boost_timeline` (score = unix-время). Диспетчер читает наступившие
+записи, ставит задачи и только после этого передвигает их на следующий момент:
+если постановка упала, записи остаются в таймлайне и будут взяты снова.
+
+Ключи:
+    boost_timeline  - ZSET аккаунт -> время ближайшего буста
+    boost_config    - HASH аккаунт -> {"times": [...], "tz": "..."} для пересчёта без БД
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+BOOST_TIMELINE = "boost_timeline"
+BOOST_CONFIG = "boost_config"
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+# Передвигает сработавшие записи: ARGV - тройки (аккаунт, время срабатывания, следующее время или "").
+# Запись меняется, только если её время не пересчитали параллельно (schedule/sync после смены конфига)
+ADVANCE = """
+for i = 1, #ARGV, 3 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        if ARGV[i + 2] == '' then
+            redis.call('ZREM', KEYS[1], ARGV[i])
+        else
+            redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+        end
+    end
+end
+return #ARGV / 3
+"""
+
+
+def parse_boost_times(boost_times: Optional[List[str]]) -> List[Tuple[int, int]]:
+    parsed = []
+    for boost_time in boost_times or []:
+        try:
+            hour, minute = map(int, boost_time.split(":"))
+        except (ValueError, AttributeError):
+            continue
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            parsed.append((hour, minute))
+    return parsed
+
+
+def get_timezone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Unknown boost timezone {name!r}, using {DEFAULT_TIMEZONE}")
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def next_fire(boost_times: Optional[List[str]], timezone: Optional[str], after: float) -> Optional[float]:
+    """Ближайший момент буста строго после after (unix-время) по местному времени аккаунта"""
+    times = parse_boost_times(boost_times)
+    if not times:
+        return None
+    tz = get_timezone(timezone)
+    today = datetime.fromtimestamp(after, tz).date()
+    candidates = []
+    # Три дня с запасом на переход на летнее/зимнее время
+    for days in range(3):
+        day = today + timedelta(days=days)
+        for hour, minute in times:
+            fire_at = datetime(day.year, day.month, day.day, hour, minute, tzinfo=tz).timestamp()
+            if fire_at > after:
+                candidates.append(fire_at)
+    return min(candidates) if candidates else None
+
+
+class BoostTimeline:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._advance = redis_client.register_script(ADVANCE)
+
+    @staticmethod
+    def _config(boost_times: Optional[List[str]], timezone: Optional[str]) -> str:
+        return json.dumps({"times": list(boost_times or []), "tz": timezone or DEFAULT_TIMEZONE})
+
+    async def schedule(self, account_id: str, boost_times: Optional[List[str]], timezone: Optional[str], now: float) -> Optional[float]:
+        """Пересчитывает ближайший буст аккаунта после изменения конфига"""
+        fire_at = next_fire(boost_times, timezone, now)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if fire_at is None:
+                pipe.zrem(BOOST_TIMELINE, account_id)
+                pipe.hdel(BOOST_CONFIG, account_id)
+            else:
+                pipe.zadd(BOOST_TIMELINE, {account_id: fire_at})
+                pipe.hset(BOOST_CONFIG, account_id, self._config(boost_times, timezone))
+            await pipe.execute()
+        return fire_at
+
+    async def remove(self, account_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(BOOST_TIMELINE, account_id)
+            pipe.hdel(BOOST_CONFIG, account_id)
+            await pipe.execute()
+
+    async def sync(self, configs: Dict[str, Tuple[Optional[List[str]], Optional[str]]], now: float) -> int:
+        """
+        Полная сверка с БД: новые и изменившиеся конфиги пересчитываются,
+        аккаунты вне configs удаляются. Неизменённые записи не трогаются.
+        Возвращает число изменённых записей.
+        """
+        stored = await self.redis.hgetall(BOOST_CONFIG)
+        scheduled = set(await self.redis.zrange(BOOST_TIMELINE, 0, -1))
+        fires: Dict[str, float] = {}
+        new_configs: Dict[str, str] = {}
+        drop = [a for a in stored.keys() | scheduled if a not in configs]
+
+        for account_id, (boost_times, timezone) in configs.items():
+            config = self._config(boost_times, timezone)
+            if stored.get(account_id) == config and account_id in scheduled:
+                continue
+            fire_at = next_fire(boost_times, timezone, now)
+            if fire_at is None:
+                drop.append(account_id)
+            else:
+                fires[account_id] = fire_at
+                new_configs[account_id] = config
+
+        if fires or drop:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if drop:
+                    pipe.zrem(BOOST_TIMELINE, *drop)
+                    pipe.hdel(BOOST_CONFIG, *drop)
+                if fires:
+                    pipe.zadd(BOOST_TIMELINE, fires)
+                    pipe.hset(BOOST_CONFIG, mapping=new_configs)
+                await pipe.execute()
+        return len(fires) + len(drop)
+
+    async def due(self, now: float, limit: int = 500) -> List[Tuple[str, float]]:
+        """Наступившие записи; из таймлайна не удаляются до advance"""
+        items = await self.redis.zrangebyscore(BOOST_TIMELINE, "-inf", now, start=0, num=limit, withscores=True)
+        return [(account_id, float(fire_at)) for account_id, fire_at in items]
+
+    async def advance(self, fired: List[Tuple[str, float]], now: float):
+        """
+        Следующий буст для сработавших аккаунтов - по сохранённому конфигу, без БД.
+        Считается от max(now, время срабатывания): после простоя пропущенные слоты
+        не перебираются по одному.
+        """
+        if not fired:
+            return
+        account_ids = [account_id for account_id, _ in fired]
+        configs = await self.redis.hmget(BOOST_CONFIG, account_ids)
+        args = []
+        for (account_id, fired_at), raw in zip(fired, configs):
+            fire_at = None
+            if raw:
+                config = json.loads(raw)
+                fire_at = next_fire(config["times"], config["tz"], max(now, fired_at))
+            args += [account_id, fired_at, "" if fire_at is None else fire_at]
+        await self._advance(keys=[BOOST_TIMELINE], args=args)
+
+    async def next_due(self) -> Optional[float]:
+        head = await self.redis.zrange(BOOST_TIMELINE, 0, 0, withscores=True)
+        return float(head[0][1]) if head else None
@@ -0,0 +1,68 @@
+"""
+Кеш решений по карточкам
+
+Отпечаток профиля - хеш имени с возрастом и пути первого фото (без хоста CDN
+и query-параметров). По отпечатку в `card_cache:<аккаунт>:<отпечаток>` лежит
+только решение (балл, лайк, суперлайк, версия конфига) в несколько десятков
+байт с коротким TTL: Redis общий с очередями и работает без вытеснения,
+карточки целиком в нём не храним.
+
+Повторная карточка (VK показывает её снова после перезагрузки ленты) в пределах
+TTL решается без разбора и оценки. После TTL или смены конфига карточка
+разбирается и оценивается заново - отдельного индекса «уже видел» нет.
+"""
+import json
+import hashlib
+import logging
+from typing import Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+def profile_fingerprint(signature: str) -> Optional[str]:
+    """Отпечаток по подписи карточки 'Имя, 25|https://.../photo.jpg?size=...'"""
+    raw_name, _, photo_url = signature.partition("|")
+    raw_name = " ".join(raw_name.lower().split())
+    if not raw_name:
+        return None
+    photo_path = urlsplit(photo_url).path if photo_url else ""
+    return hashlib.sha1(f"{raw_name}|{photo_path}".encode()).hexdigest()
+
+
+class DecisionCache:
+    def __init__(self, redis_client, account_id: str, ttl: int = 3600):
+        self.redis = redis_client
+        self.account_id = account_id
+        self.ttl = ttl
+
+    def _key(self, fingerprint: str) -> str:
+        return f"card_cache:{self.account_id}:{fingerprint}"
+
+    async def get(self, fingerprint: str) -> Optional[dict]:
+        """Закешированное решение {"score", "like", "superlike", "version"} или None"""
+        raw = await self.redis.get(self._key(fingerprint))
+        if not raw:
+            return None
+        try:
+            cached = json.loads(raw)
+            return {
+                "score": cached["s"],
+                "like": bool(cached["l"]),
+                "superlike": bool(cached["sl"]),
+                "version": cached.get("v")
+            }
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    async def put(self, fingerprint: str, decision: dict, version: Optional[str] = None):
+        await self.redis.set(
+            self._key(fingerprint),
+            json.dumps({
+                "s": decision.get("score", 0),
+                "l": int(bool(decision.get("like"))),
+                "sl": int(bool(decision.get("superlike"))),
+                "v": version
+            }, separators=(",", ":")),
+            ex=self.ttl
+        )
@@ -8,8 +8,10 @@ import json
 import asyncio
 import logging
 import re
+import random
+import hashlib
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable, Set
 
 import redis.asyncio as redis
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page, FrameLocator
@@ -18,17 +20,50 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 from sqlalchemy import text
 
 from vk_selectors import VKDatingSelectors as S, VKDatingHotkeys as K
+from task_queue import ReliableQueue
+from activity_log import ActivityBuffer
+from account_state import AccountStateBuffer
+from scoring import get_scorer
+from decision_cache import DecisionCache, profile_fingerprint
+from session_codec import session_key, encode_session, decode_session, prune_state
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+# Аккаунты в этих статусах (и с выключенным ботом) не поднимаются задачами без start_session
+NO_COLD_START_STATUSES = ("inactive", "banned", "auth_required")
+
+
 class Settings(BaseSettings):
     database_url: str
     redis_url: str
     max_browsers: int = 8
+    shared_browsers: bool = True  # True = общие процессы Chromium + BrowserContext на аккаунт
+    browser_processes: int = 2  # Число процессов Chromium в shared-режиме
+    max_concurrent_tasks: int = 0  # 0 = по числу браузеров (max_browsers)
+    max_pending_tasks: int = 0  # Взятых из Redis и ещё не выполненных задач; 0 = 4 * max_concurrent_tasks
+    account_queue_limit: int = 10  # Задач в очереди одного аккаунта; лишние откладываются в Redis
+    account_queue_defer: int = 30  # На сколько секунд откладывается задача переполненного аккаунта
+    task_visibility_timeout: int = 300  # Через сколько секунд задачи упавшего воркера вернутся в очередь
+    task_max_attempts: int = 5  # После стольких неудач задача уходит в task_queue:dead
+    task_retry_backoff: int = 10  # Базовая задержка ретрая, секунды (удваивается)
+    activity_batch_size: int = 200  # Строк activity_log в одном COPY
+    activity_flush_interval: float = 5.0  # Секунд между сбросами буфера
+    account_state_flush_interval: float = 3.0  # Секунд между пакетными UPDATE статусов vk_accounts
+    # Темп свайпов (имитация человека) - отдельно от ожидания загрузки карточки
+    pace_min_delay: float = 1.0
+    pace_max_delay: float = 3.0
+    pace_long_pause_chance: float = 0.05  # Вероятность долгой паузы после свайпа
+    pace_long_pause: float = 15.0
+    card_wait_timeout: float = 10.0  # Сколько ждать появления следующей карточки, секунды
+    # Индекс просмотренных профилей (Bloom-фильтр в Redis на аккаунт)
+    card_cache_ttl: int = 3600  # Кеш решений по карточкам (без самих карточек), секунды
+    session_persist_interval: int = 120  # Как часто проверять cookies контекстов и сохранять изменившиеся сессии
+    match_scan_limit: int = 200  # Сколько людей читать со вкладки за проверку матчей
     browser_timeout: int = 30000
     worker_id: str = "worker-1"
+    session_secret: str  # Ключ шифрования сессий в vk_accounts (тот же, что у API)
     use_desktop: bool = True  # True = vk.com/dating, False = m.vk.com/dating
     anthropic_api_key: Optional[str] = None
     class Config:
@@ -38,6 +73,7 @@ settings = Settings()
 DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://")
 engine = create_async_engine(DATABASE_URL, echo=False)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+SESSION_KEY = session_key(settings.session_secret)
 
 
 # Мобильные селекторы (m.vk.com/dating)
@@ -56,63 +92,253 @@ class VKMobileSelectors:
     PROFILE_NAME = '[class*="vkuiTitle__level2"][class*="accent"]'
     PROFILE_INFO = '[class*="vkuiMiniInfoCell"]'
     PROFILE_TEXT = '[class*="vkuiText"], [class*="vkuiParagraph"]'
+    PHOTO_CONTAINER = '[class*="vkuiGallery"]'
+
+
+NAME_AGE_RE = re.compile(r'^(.+?),\s*(\d+)$')
+
+
+def split_name_age(raw_name: str) -> dict:
+    """'Аня, 25' -> {"name": "Аня", "age": 25}; без возраста - только name"""
+    match = NAME_AGE_RE.match(raw_name)
+    if match:
+        return {"name": match.group(1), "age": int(match.group(2))}
+    return {"name": raw_name}
+
+# Селекторы карточки для EXTRACT_CARD_JS (только CSS - без playwright-псевдоклассов вроде :has-text)
+DESKTOP_CARD_SELECTORS = {
+    "name": S.PROFILE_NAME,
+    "bio": S.PROFILE_BIO,
+    "info": S.PROFILE_EDUCATION,
+    "text": None,
+    "looking_for": S.PROFILE_LOOKING_FOR,
+    "interests_header": ".vkuiHeader__contentIn",
+    "interests_label": "Интересы",
+    "photo": S.PHOTO_CONTAINER
+}
+
+MOBILE_CARD_SELECTORS = {
+    "name": VKMobileSelectors.PROFILE_NAME,
+    "bio": None,
+    "info": VKMobileSelectors.PROFILE_INFO,
+    "text": VKMobileSelectors.PROFILE_TEXT,
+    "looking_for": None,
+    "interests_header": ".vkuiHeader__contentIn",
+    "interests_label": "Интересы",
+    "photo": VKMobileSelectors.PHOTO_CONTAINER
+}
+
+# Ждёт смены карточки через MutationObserver: резолвится, как только
+# подпись карточки (имя + первое фото) непустая и отличается от prev, или по таймауту (null)
+WAIT_NEXT_CARD_JS = """
+(root, args) => new Promise(resolve => {
+    const sel = args.selectors;
+    const signature = () => {
+        const name = document.querySelector(sel.name);
+        const photo = sel.photo ? document.querySelector(sel.photo + ' img') : null;
+        const nameText = ((name && name.innerText) || '').trim();
+        if (!nameText) return null;
+        return nameText + '|' + (photo ? (photo.currentSrc || photo.src) : '');
+    };
+    const ready = () => {
+        const current = signature();
+        return current && current !== args.prev ? current : null;
+    };
+    const found = ready();
+    if (found) return resolve(found);
+
+    const observer = new MutationObserver(() => {
+        const current = ready();
+        if (current) {
+            observer.disconnect();
+            clearTimeout(timer);
+            resolve(current);
+        }
+    });
+    const timer = setTimeout(() => { observer.disconnect(); resolve(null); }, args.timeout);
+    observer.observe(document.body, {childList: true, subtree: true, characterData: true, attributes: true, attributeFilter: ['src']});
+})
+"""
+
+# Вся карточка за один вызов в странице вместо десятков count()/inner_text()
+EXTRACT_CARD_JS = """
+(root, sel) => {
+    const text = el => ((el && el.innerText) || '').trim();
+    const first = s => s ? text(document.querySelector(s)) : '';
+    const all = (s, limit) => s
+        ? Array.from(document.querySelectorAll(s)).slice(0, limit).map(text).filter(Boolean)
+        : [];
+
+    let interests = [];
+    if (sel.interests_header) {
+        const header = Array.from(document.querySelectorAll(sel.interests_header))
+            .find(h => text(h).includes(sel.interests_label));
+        const section = header && (header.closest('section, [class*="vkuiGroup"]')
+            || (header.parentElement && header.parentElement.parentElement));
+        if (section) {
+            const title = text(header);
+            interests = text(section).split('\\n').map(s => s.trim()).filter(s => s && s !== title);
+        }
+    }
+
+    const photos = sel.photo ? Array.from(document.querySelectorAll(sel.photo + ' img')) : [];
+    return {
+        raw_name: first(sel.name),
+        bio: first(sel.bio),
+        texts: all(sel.text, 10),
+        info: all(sel.info, 5),
+        looking_for: first(sel.looking_for),
+        interests: interests,
+        photo_count: photos.length,
+        photo_url: photos.length ? (photos[0].currentSrc || photos[0].src) : null
+    };
+}
+"""
+
+
+# Списки вкладок "Лайки" и "Чаты" для EXTRACT_PEOPLE_JS
+DESKTOP_PEOPLE_SELECTORS = {
+    "likes": S.CHAT_MATCHES,
+    "chats": S.CHAT_LIST_ITEM
+}
+
+MOBILE_PEOPLE_SELECTORS = {
+    "likes": '[class*="vkuiHorizontalCell"]',
+    "chats": '[class*="vkuiSimpleCell"]'
+}
+
+# Все люди из списка вкладки за один вызов: первая строка - имя, вторая - превью сообщения
+EXTRACT_PEOPLE_JS = """
+(root, args) => Array.from(document.querySelectorAll(args.item)).slice(0, args.limit).map(el => {
+    const lines = (el.innerText || '').split('\\n').map(l => l.trim()).filter(Boolean);
+    const img = el.querySelector('img');
+    return {
+        raw_name: lines[0] || '',
+        preview: lines.slice(1).join(' ') || null,
+        photo_url: img ? (img.currentSrc || img.src) : null
+    };
+}).filter(p => p.raw_name)
+"""
+
+BROWSER_ARGS = [
+    '--no-sandbox', 
+    '--disable-setuid-sandbox', 
+    '--disable-dev-shm-usage', 
+    '--disable-gpu', 
+    '--no-first-run', 
+    '--no-zygote', 
+    '--disable-blink-features=AutomationControlled'
+]
+
+DESKTOP_CONTEXT = {
+    "viewport": {"width": 1280, "height": 900},
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "locale": "ru-RU",
+    "timezone_id": "Europe/Moscow"
+}
+
+MOBILE_CONTEXT = {
+    "viewport": {"width": 414, "height": 896},
+    "user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1",
+    "locale": "ru-RU",
+    "timezone_id": "Europe/Moscow"
+}
 
 
 class BrowserPool:
-    def __init__(self, max_browsers: int = 8):
+    """
+    Пул браузеров для аккаунтов.
+    
+    shared=True: несколько долгоживущих процессов Chromium, каждому аккаунту
+    выдаётся изолированный BrowserContext со своим storage_state.
+    shared=False: отдельный процесс Chromium на каждый аккаунт (старый режим).
+    
+    Сессии отдаются в on_session(account_id, storage_state) только если
+    cookies изменились с последнего сохранения: периодически (persist_sessions),
+    при вытеснении и при освобождении браузера.
+    
+    Вытесняется самый давно активный контекст из тех, где is_busy(account_id)
+    ложно (бот не свайпает). Если заняты все - самый старый занятый, и владелец
+    узнаёт об этом через on_evict(account_id), чтобы остановить бота.
+    """
+    
+    def __init__(
+        self,
+        max_browsers: int = 8,
+        shared: bool = True,
+        processes: int = 2,
+        on_session: Optional[Callable[[str, dict], None]] = None,
+        is_busy: Optional[Callable[[str], bool]] = None,
+        on_evict: Optional[Callable[[str], None]] = None
+    ):
         self.max_browsers = max_browsers
+        self.shared = shared
+        self.processes = max(1, processes)
+        self.on_session = on_session
+        self.is_busy = is_busy
+        self.on_evict = on_evict
         self.browsers: Dict[str, Dict[str, Any]] = {}
+        self.shared_browsers: List[Browser] = []
         self.playwright = None
         self.lock = asyncio.Lock()
         
     async def start(self):
         self.playwright = await async_playwright().start()
-        logger.info(f"🚀 Browser pool started (max: {self.max_browsers})")
+        mode = f"shared, {self.processes} processes" if self.shared else "isolated"
+        logger.info(f"🚀 Browser pool started (max: {self.max_browsers}, mode: {mode})")
         
     async def stop(self):
-        for account_id in list(self.browsers.keys()):
-            await self.release(account_id)
+        async with self.lock:
+            for account_id in list(self.browsers.keys()):
+                await self._release(account_id)
+            for browser in self.shared_browsers:
+                try:
+                    await browser.close()
+                except:
+                    pass
+            self.shared_browsers.clear()
         if self.playwright:
             await self.playwright.stop()
+    
+    async def _launch(self) -> Browser:
+        args = list(BROWSER_ARGS)
+        if not self.shared:
+            # --single-process нестабилен с несколькими контекстами в одном процессе
+            args.append('--single-process')
+        return await self.playwright.chromium.launch(headless=True, args=args)
+    
+    async def _acquire_browser(self) -> Browser:
+        """Возвращает процесс Chromium для нового контекста"""
+        if not self.shared:
+            return await self._launch()
+        
+        # Упавшие процессы убираем и при необходимости поднимаем заново
+        self.shared_browsers = [b for b in self.shared_browsers if b.is_connected()]
+        if len(self.shared_browsers) < self.processes:
+            browser = await self._launch()
+            self.shared_browsers.append(browser)
+            logger.info(f"🧩 Shared browser launched ({len(self.shared_browsers)}/{self.processes})")
+            return browser
+        
+        # Наименее загруженный процесс
+        return min(self.shared_browsers, key=lambda b: len(b.contexts))
         
     async def get_or_create(self, account_id: str, session_data: Optional[dict] = None, desktop: bool = True) -> Page:
         async with self.lock:
             if account_id in self.browsers:
-                self.browsers[account_id]["last_active"] = datetime.utcnow()
-                return self.browsers[account_id]["page"]
+                entry = self.browsers[account_id]
+                if not entry["page"].is_closed():
+                    entry["last_active"] = datetime.utcnow()
+                    return entry["page"]
+                # Процесс браузера упал вместе с контекстом - пересоздаём
+                await self._release(account_id, save_session=False)
             
             if len(self.browsers) >= self.max_browsers:
                 await self._evict_least_active()
             
-            browser = await self.playwright.chromium.launch(
-                headless=True,
-                args=[
-                    '--no-sandbox', 
-                    '--disable-setuid-sandbox', 
-                    '--disable-dev-shm-usage', 
-                    '--disable-gpu', 
-                    '--no-first-run', 
-                    '--no-zygote', 
-                    '--single-process',
-                    '--disable-blink-features=AutomationControlled'
-                ]
-            )
+            browser = await self._acquire_browser()
             
-            if desktop:
-                context_options = {
-                    "viewport": {"width": 1280, "height": 900},
-                    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "locale": "ru-RU",
-                    "timezone_id": "Europe/Moscow"
-                }
-            else:
-                context_options = {
-                    "viewport": {"width": 414, "height": 896},
-                    "user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1",
-                    "locale": "ru-RU",
-                    "timezone_id": "Europe/Moscow"
-                }
-                
+            context_options = dict(DESKTOP_CONTEXT if desktop else MOBILE_CONTEXT)
             if session_data:
                 context_options["storage_state"] = session_data
                 
@@ -130,52 +356,157 @@ class BrowserPool:
                 "context": context, 
                 "page": page, 
                 "last_active": datetime.utcnow(),
-                "desktop": desktop
+                "desktop": desktop,
+                # Хеш уже сохранённых cookies: неизменённую сессию не перезаписываем
+                "cookie_hash": self.cookie_hash(session_data.get("cookies", [])) if session_data else None
             }
             logger.info(f"🌐 Browser created for account {account_id[:8]}... ({len(self.browsers)}/{self.max_browsers})")
             return page
     
-    async def release(self, account_id: str, save_session: bool = True) -> Optional[dict]:
+    @staticmethod
+    def cookie_hash(cookies: List[dict]) -> str:
+        """Хеш cookies VK; срок жизни - с точностью до суток, чтобы скользящее продление не вызывало запись"""
+        items = sorted(
+            (c.get("domain", ""), c.get("path", ""), c.get("name", ""), c.get("value", ""), int(c.get("expires", -1) // 86400))
+            for c in prune_state({"cookies": cookies})["cookies"]
+        )
+        return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+    
+    async def _persist(self, account_id: str, entry: dict) -> bool:
+        """Сохраняет сессию, если cookies изменились. context.cookies() дешевле полного storage_state()"""
+        if not self.on_session:
+            return False
+        try:
+            cookie_hash = self.cookie_hash(await entry["context"].cookies())
+            if cookie_hash == entry.get("cookie_hash"):
+                return False
+            state = await entry["context"].storage_state()
+        except Exception as e:
+            logger.debug(f"Session snapshot error for {account_id[:8]}: {e}")
+            return False
+        entry["cookie_hash"] = cookie_hash
+        self.on_session(account_id, state)
+        return True
+    
+    async def persist_sessions(self) -> int:
+        """Сохраняет изменившиеся сессии всех контекстов. Возвращает число сохранённых"""
+        saved = 0
+        for account_id, entry in list(self.browsers.items()):
+            if entry["page"].is_closed():
+                continue
+            if await self._persist(account_id, entry):
+                saved += 1
+        return saved
+    
+    def has_capacity(self) -> bool:
+        """Есть ли место под новый контекст без вытеснения"""
+        return len(self.browsers) < self.max_browsers
+    
+    def touch(self, account_id: str):
+        """Отодвигает вытеснение контекста аккаунта"""
+        if account_id in self.browsers:
+            self.browsers[account_id]["last_active"] = datetime.utcnow()
+    
+    async def release(self, account_id: str, save_session: bool = True):
         async with self.lock:
-            if account_id not in self.browsers:
-                return None
-            entry = self.browsers[account_id]
-            session_data = None
-            if save_session:
-                try:
-                    session_data = await entry["context"].storage_state()
-                except:
-                    pass
-            try:
+            await self._release(account_id, save_session)
+    
+    async def _release(self, account_id: str, save_session: bool = True):
+        """Освобождает браузер аккаунта (вызывать под self.lock)"""
+        if account_id not in self.browsers:
+            return
+        entry = self.browsers[account_id]
+        if save_session:
+            await self._persist(account_id, entry)
+        try:
+            if self.shared:
+                # Процесс общий - закрываем только контекст аккаунта
+                await entry["context"].close()
+            else:
                 await entry["browser"].close()
-            except:
-                pass
-            del self.browsers[account_id]
-            return session_data
+        except:
+            pass
+        del self.browsers[account_id]
     
     async def _evict_least_active(self):
         if not self.browsers:
             return
-        oldest = min(self.browsers.items(), key=lambda x: x[1]["last_active"])
-        await self.release(oldest[0])
+        candidates = self.browsers
+        if self.is_busy:
+            idle = {a: b for a, b in self.browsers.items() if not self.is_busy(a)}
+            candidates = idle or self.browsers
+        account_id = min(candidates, key=lambda a: candidates[a]["last_active"])
+        if self.on_evict:
+            self.on_evict(account_id)
+        await self._release(account_id)
     
     def get_status(self) -> dict:
         return {
             "active_browsers": len(self.browsers), 
             "max_browsers": self.max_browsers, 
+            "shared": self.shared,
+            "processes": len(self.shared_browsers) if self.shared else len(self.browsers),
             "accounts": list(self.browsers.keys())
         }
 
 
+class PacingPolicy:
+    """Человекоподобные паузы между свайпами: равномерный джиттер + редкие долгие паузы"""
+    
+    def __init__(self, min_delay: float = 1.0, max_delay: float = 3.0, long_pause_chance: float = 0.05, long_pause: float = 15.0):
+        self.min_delay = min_delay
+        self.max_delay = max(min_delay, max_delay)
+        self.long_pause_chance = long_pause_chance
+        self.long_pause = long_pause
+    
+    @classmethod
+    def from_settings(cls) -> "PacingPolicy":
+        return cls(
+            settings.pace_min_delay,
+            settings.pace_max_delay,
+            settings.pace_long_pause_chance,
+            settings.pace_long_pause
+        )
+    
+    def next_delay(self) -> float:
+        delay = random.uniform(self.min_delay, self.max_delay)
+        if random.random() < self.long_pause_chance:
+            delay += random.uniform(self.long_pause / 2, self.long_pause)
+        return delay
+    
+    async def pause(self):
+        await asyncio.sleep(self.next_delay())
+
+
 class VKDatingBot:
     """Бот для VK Dating - поддержка десктоп и мобильной версии"""
     
-    def __init__(self, page: Page, account_id: str, config: dict, desktop: bool = True):
+    def __init__(
+        self,
+        page: Page,
+        account_id: str,
+        config: dict,
+        desktop: bool = True,
+        client_id: Optional[str] = None,
+        activity: Optional[ActivityBuffer] = None,
+        decisions: Optional[DecisionCache] = None
+    ):
         self.page = page
         self.account_id = account_id
+        self.client_id = client_id
+        self.activity = activity
+        self.decisions = decisions
+        self.pacing = PacingPolicy.from_settings()
         self.config = config
+        # Фильтры квеста компилируются один раз на версию конфига
+        self.scorer = get_scorer(config)
         self.desktop = desktop
         self.running = True
+        self.swiping = False
+        # Страница одна на аккаунт: свайп карточки и буст/проверка матчей не перемежаются.
+        # page_moved - страницу трогали между свайпами: вернуться на анкеты и перечитать карточку
+        self.page_lock = asyncio.Lock()
+        self.page_moved = False
         self.stats = {"likes": 0, "skips": 0, "matches": 0, "superlikes": 0}
         self.frame: FrameLocator | None = None
         
@@ -191,15 +522,14 @@ class VKDatingBot:
         
         url = "https://vk.com/dating" if self.desktop else "https://m.vk.com/dating"
         await self.page.goto(url, wait_until="domcontentloaded")
-        await asyncio.sleep(2)
         
         if self.desktop:
-            # Определяем iframe
+            # Определяем iframe - ждём его появления, а не фиксированную паузу
             try:
+                await self.page.wait_for_selector('iframe', timeout=10000)
                 iframes = await self.page.locator('iframe').count()
-                if iframes > 0:
-                    self.frame = self.page.frame_locator('iframe').first
-                    logger.info(f"📦 Iframe detected ({iframes})")
+                self.frame = self.page.frame_locator('iframe').first
+                logger.info(f"📦 Iframe detected ({iframes})")
             except Exception as e:
                 logger.warning(f"Iframe detection error: {e}")
         
@@ -207,7 +537,10 @@ class VKDatingBot:
         try:
             if self.desktop:
                 # Для десктопа ждём кнопку лайка
-                await self.page.wait_for_timeout(3000)
+                try:
+                    await self.get_locator(S.BTN_LIKE).first.wait_for(state="visible", timeout=15000)
+                except Exception as e:
+                    logger.warning(f"Like button not visible yet for {self.account_id[:8]}: {e}")
                 # Активируем страницу для горячих клавиш
                 await self.page.click('body')
                 logger.info(f"✅ VK Dating (desktop) loaded for {self.account_id[:8]}")
@@ -220,62 +553,35 @@ class VKDatingBot:
             return False
     
     async def parse_card(self) -> Optional[dict]:
-        """Парсит текущую карточку профиля"""
+        """Парсит текущую карточку профиля одним запросом в страницу"""
         try:
+            selectors = DESKTOP_CARD_SELECTORS if self.desktop else MOBILE_CARD_SELECTORS
+            raw = await self.get_locator("body").evaluate(EXTRACT_CARD_JS, selectors, timeout=5000)
+            
             data = {
                 "timestamp": datetime.utcnow().isoformat(),
                 "account_id": self.account_id
             }
             
+            name_text = raw.get("raw_name")
+            if name_text:
+                data["raw_name"] = name_text
+                data.update(split_name_age(name_text))
+            
             if self.desktop:
-                # Десктоп версия
-                name_el = self.get_locator(S.PROFILE_NAME)
-                if await name_el.count() > 0:
-                    name_text = await name_el.first.inner_text()
-                    data["raw_name"] = name_text
-                    match = re.match(r'^(.+?),\s*(\d+)$', name_text.strip())
-                    if match:
-                        data["name"] = match.group(1)
-                        data["age"] = int(match.group(2))
-                    else:
-                        data["name"] = name_text
-                
-                bio_el = self.get_locator(S.PROFILE_BIO)
-                if await bio_el.count() > 0:
-                    data["bio"] = await bio_el.first.inner_text()
-                    
+                if raw.get("bio"):
+                    data["bio"] = raw["bio"]
             else:
-                # Мобильная версия
-                name_el = self.page.locator(VKMobileSelectors.PROFILE_NAME).first
-                if await name_el.is_visible(timeout=5000):
-                    name_text = await name_el.inner_text()
-                    data["raw_name"] = name_text
-                    match = re.match(r'^(.+?),\s*(\d+)$', name_text.strip())
-                    if match:
-                        data["name"] = match.group(1)
-                        data["age"] = int(match.group(2))
-                    else:
-                        data["name"] = name_text
-                
-                # Info items
-                info_items = []
-                info_els = self.page.locator(VKMobileSelectors.PROFILE_INFO)
-                count = await info_els.count()
-                for i in range(min(count, 5)):
-                    text = await info_els.nth(i).inner_text()
-                    if text.strip():
-                        info_items.append(text.strip())
-                data["info"] = info_items
-                
-                # Bio
-                text_els = self.page.locator(VKMobileSelectors.PROFILE_TEXT)
-                texts = []
-                count = await text_els.count()
-                for i in range(min(count, 10)):
-                    text = await text_els.nth(i).inner_text()
-                    if text.strip() and len(text.strip()) > 3:
-                        texts.append(text.strip())
-                data["bio"] = " ".join(texts)
+                data["bio"] = " ".join(t for t in raw.get("texts", []) if len(t) > 3)
+            data["info"] = raw.get("info", [])
+            
+            if raw.get("looking_for"):
+                data["looking_for"] = raw["looking_for"]
+            if raw.get("interests"):
+                data["interests"] = raw["interests"]
+            data["photo_count"] = raw.get("photo_count", 0)
+            if raw.get("photo_url"):
+                data["photo_url"] = raw["photo_url"]
             
             if data.get("name"):
                 logger.info(f"👤 Parsed: {data.get('name', 'Unknown')}, {data.get('age', '?')}")
@@ -287,63 +593,12 @@ class VKDatingBot:
     
     def evaluate_card(self, card_data: dict) -> dict:
         """Оценивает карточку по настроенным критериям"""
-        quest = self.config.get("active_quest", "ideal_date")
-        filters = self.config.get("quest_filters", {})
-        
-        score = 0
-        reasons = []
-        
-        age = card_data.get("age", 0)
-        bio = (card_data.get("bio") or "").lower()
-        info = " ".join(card_data.get("info", [])).lower()
-        
-        # Фильтр по возрасту
-        min_age = filters.get("min_age", 18)
-        max_age = filters.get("max_age", 100)
-        if min_age <= age <= max_age:
-            score += 10
-            reasons.append(f"возраст {age} ок")
-        elif age > 0:
-            score -= 50
-            reasons.append(f"возраст {age} вне диапазона")
-        
-        # Оценка по квесту
-        if quest == "ideal_date":
-            target_interests = filters.get("interests", ["путешествия", "музыка", "кино", "спорт"])
-            for interest in target_interests:
-                if interest.lower() in bio or interest.lower() in info:
-                    score += 15
-                    reasons.append(f"интерес: {interest}")
-                    
-        elif quest == "investor":
-            keywords = ["инвестор", "бизнес", "стартап", "ceo", "founder", "предприниматель", "директор"]
-            for kw in keywords:
-                if kw in bio or kw in info:
-                    score += 40
-                    reasons.append(f"бизнес: {kw}")
-                    
-        elif quest == "creative":
-            keywords = ["художник", "музыкант", "дизайнер", "фотограф", "творческ", "искусств"]
-            for kw in keywords:
-                if kw in bio or kw in info:
-                    score += 30
-                    reasons.append(f"творчество: {kw}")
-        
-        # Негативные фильтры
-        negative = filters.get("negative_keywords", [])
-        for neg in negative:
-            if neg.lower() in bio:
-                score -= 100
-                reasons.append(f"негатив: {neg}")
-        
-        decision = {
-            "like": score >= filters.get("min_score", 20),
-            "superlike": score >= filters.get("superlike_score", 60),
-            "score": score,
-            "reasons": reasons
-        }
-        
-        return decision
+        return self.scorer.score(card_data)
+    
+    def update_config(self, config: dict):
+        """Подменяет конфиг работающего бота; скорер компилируется до подмены, браузер не трогается"""
+        scorer = get_scorer(config)
+        self.config, self.scorer = config, scorer
     
     async def action_like(self) -> bool:
         """Ставит лайк"""
@@ -355,7 +610,6 @@ class VKDatingBot:
                 btn = self.page.locator(VKMobileSelectors.BTN_LIKE).first
                 await btn.click()
             self.stats["likes"] += 1
-            await asyncio.sleep(0.5)
             return True
         except Exception as e:
             logger.error(f"Error liking: {e}")
@@ -370,7 +624,6 @@ class VKDatingBot:
                 btn = self.page.locator(VKMobileSelectors.BTN_SKIP).first
                 await btn.click()
             self.stats["skips"] += 1
-            await asyncio.sleep(0.5)
             return True
         except Exception as e:
             logger.error(f"Error skipping: {e}")
@@ -383,11 +636,13 @@ class VKDatingBot:
                 btn = self.get_locator(S.BTN_SUPERLIKE)
                 if await btn.count() > 0:
                     await btn.click()
-                    await asyncio.sleep(0.5)
-                    # Подтверждение
-                    confirm = self.get_locator(S.BTN_SEND_SUPERLIKE)
-                    if await confirm.count() > 0:
+                    # Подтверждение - ждём попап, а не фиксированную паузу
+                    confirm = self.get_locator(S.BTN_SEND_SUPERLIKE).first
+                    try:
+                        await confirm.wait_for(state="visible", timeout=3000)
                         await confirm.click()
+                    except Exception:
+                        pass
             else:
                 btn = self.page.locator(VKMobileSelectors.BTN_SUPERLIKE).first
                 if await btn.is_visible():
@@ -395,12 +650,83 @@ class VKDatingBot:
             
             self.stats["superlikes"] += 1
             logger.info("🔥 Superlike!")
-            await asyncio.sleep(0.5)
             return True
         except Exception as e:
             logger.error(f"Error superlking: {e}")
             return False
     
+    async def action_boost(self) -> bool:
+        """Активирует буст (кнопка на вкладке анкет)"""
+        try:
+            if self.desktop:
+                btn = self.get_locator(S.BTN_BOOST).first
+                confirm = self.get_locator(S.BTN_BOOST_CONFIRM).first
+            else:
+                btn = self.page.locator(VKMobileSelectors.BTN_BOOST).first
+                confirm = None
+            if await btn.count() == 0:
+                logger.warning(f"Boost button not found for {self.account_id[:8]}")
+                return False
+            await btn.click()
+            if confirm is not None:
+                try:
+                    await confirm.wait_for(state="visible", timeout=3000)
+                    await confirm.click()
+                except Exception:
+                    pass
+            logger.info("⚡ Boost activated")
+            return True
+        except Exception as e:
+            logger.error(f"Error activating boost: {e}")
+            return False
+    
+    async def activate_boost(self) -> bool:
+        # Между свайпами фоновой сессии: её текущий шаг доработает, следующий подождёт буст
+        async with self.page_lock:
+            if not self.swiping:
+                # Во время свайпов вкладка анкет уже открыта
+                await self.go_to_tab("cards")
+            ok = await self.action_boost()
+            self.page_moved = self.swiping
+        self.record_activity("boost", None, None, ok)
+        return ok
+    
+    async def scan_people(self, tab: str) -> List[dict]:
+        """Открывает вкладку и читает весь список людей одним запросом в страницу"""
+        if not await self.go_to_tab(tab):
+            return []
+        selectors = DESKTOP_PEOPLE_SELECTORS if self.desktop else MOBILE_PEOPLE_SELECTORS
+        try:
+            people = await self.get_locator("body").evaluate(
+                EXTRACT_PEOPLE_JS,
+                {"item": selectors[tab], "limit": settings.match_scan_limit},
+                timeout=5000
+            )
+        except Exception as e:
+            logger.error(f"Error scanning {tab}: {e}")
+            return []
+        for person in people:
+            person["source"] = tab
+            person["fingerprint"] = profile_fingerprint(self.card_signature(person))
+            person.update(split_name_age(person["raw_name"]))
+        return people
+    
+    async def check_matches(self) -> List[dict]:
+        """
+        Матчи (вкладка лайков) и чаты; человек из обеих вкладок - одной записью из чатов.
+        Вкладки переключаются под page_lock: сессия свайпов, начавшаяся во время проверки,
+        дождётся её и вернётся на вкладку анкет.
+        """
+        people = {}
+        async with self.page_lock:
+            # Со вкладки анкет уходим в любом случае - следующий шаг свайпов вернётся на неё
+            self.page_moved = True
+            for tab in ("likes", "chats"):
+                for person in await self.scan_people(tab):
+                    if person["fingerprint"]:
+                        people[person["fingerprint"]] = person
+        return list(people.values())
+    
     async def go_to_tab(self, tab: str) -> bool:
         """Переходит на указанную вкладку"""
         try:
@@ -434,54 +760,187 @@ class VKDatingBot:
     
     async def run_swipe_session(self, max_swipes: int = 50) -> dict:
         """Запускает сессию свайпов"""
+        self.swiping = True
+        try:
+            return await self._swipe_loop(max_swipes)
+        finally:
+            self.swiping = False
+    
+    async def _swipe_loop(self, max_swipes: int) -> dict:
         swipes = 0
         
-        await self.go_to_tab("cards")
-        await asyncio.sleep(2)
+        async with self.page_lock:
+            self.page_moved = False
+            await self.go_to_tab("cards")
+            signature = await self.wait_for_card()
         
         while self.running and swipes < max_swipes:
+            if self.page.is_closed():
+                # Контекст вытеснен или закрыт - крутить цикл на мёртвой странице нельзя
+                logger.warning(f"Page closed, swipe session of {self.account_id[:8]} stopped")
+                break
             try:
-                card = await self.parse_card()
-                if not card or not card.get("name"):
-                    logger.info("No card visible, waiting...")
-                    await asyncio.sleep(3)
-                    continue
-                
-                decision = self.evaluate_card(card)
-                logger.info(f"👤 {card.get('name', '?')}, {card.get('age', '?')}: "
-                           f"score={decision['score']}, like={decision['like']} "
-                           f"({', '.join(decision['reasons'][:3])})")
-                
-                if decision.get("superlike"):
-                    await self.action_superlike()
-                elif decision["like"]:
-                    await self.action_like()
-                else:
-                    await self.action_skip()
+                async with self.page_lock:
+                    if self.page_moved:
+                        # Буст или проверка матчей трогали страницу - обратно на анкеты, карточку перечитываем
+                        self.page_moved = False
+                        await self.go_to_tab("cards")
+                        signature = await self.wait_for_card()
+                    card, decision = await self.decide_card(signature)
+                    if not card:
+                        logger.info("No card visible, waiting...")
+                        signature = await self.wait_for_card()
+                        continue
+                    
+                    logger.info(f"👤 {card.get('name', '?')}, {card.get('age', '?')}: "
+                               f"score={decision['score']}, like={decision['like']} "
+                               f"({', '.join(decision['reasons'][:3])})")
+                    
+                    if decision.get("superlike"):
+                        action, ok = "superlike", await self.action_superlike()
+                    elif decision["like"]:
+                        action, ok = "like", await self.action_like()
+                    else:
+                        action, ok = "skip", await self.action_skip()
+                    self.record_activity(action, card, decision, ok)
                 
                 swipes += 1
-                await asyncio.sleep(1 + (swipes % 3))
+                # Темп задаёт PacingPolicy; следующая карточка ловится параллельно по событию DOM
+                _, signature = await asyncio.gather(
+                    self.pacing.pause(),
+                    self.wait_for_card(self.card_signature(card))
+                )
                 
             except Exception as e:
                 logger.error(f"Swipe session error: {e}")
+                signature = None
                 await asyncio.sleep(5)
         
         logger.info(f"📊 Session done: {swipes} swipes, {self.stats}")
         return self.stats
     
+    async def decide_card(self, signature: Optional[str]) -> tuple:
+        """
+        (карточка, решение) для текущей карточки или (None, None).
+        Профиль с решением в кеше при той же версии конфига решается без разбора и оценки.
+        """
+        fingerprint = profile_fingerprint(signature) if signature else None
+        if self.decisions and fingerprint:
+            cached = await self.decisions.get(fingerprint)
+            if cached and cached["version"] == self.scorer.version:
+                logger.info("🔁 Repeat card, using cached decision")
+                # Карточка не разбиралась: в activity_log - только то, что есть в подписи
+                raw_name, _, photo_url = signature.partition("|")
+                card = {
+                    "raw_name": raw_name,
+                    "photo_url": photo_url or None,
+                    "fingerprint": fingerprint,
+                    "from_cache": True,
+                    **split_name_age(raw_name)
+                }
+                return card, {
+                    "like": cached["like"],
+                    "superlike": cached["superlike"],
+                    "score": cached["score"],
+                    "reasons": ["решение из кеша"]
+                }
+        
+        card = await self.parse_card()
+        if not card or not card.get("name"):
+            return None, None
+        decision = self.evaluate_card(card)
+        
+        if self.decisions:
+            fingerprint = fingerprint or profile_fingerprint(self.card_signature(card))
+            if fingerprint:
+                await self.decisions.put(fingerprint, decision, self.scorer.version)
+        return card, decision
+    
+    @staticmethod
+    def card_signature(card: dict) -> str:
+        """Подпись карточки - та же, что вычисляет WAIT_NEXT_CARD_JS"""
+        return f"{card.get('raw_name', '')}|{card.get('photo_url') or ''}"
+    
+    async def wait_for_card(self, prev_signature: Optional[str] = None) -> Optional[str]:
+        """Ждёт карточку с подписью, отличной от prev_signature. None - по таймауту"""
+        selectors = DESKTOP_CARD_SELECTORS if self.desktop else MOBILE_CARD_SELECTORS
+        timeout_ms = int(settings.card_wait_timeout * 1000)
+        try:
+            return await self.get_locator("body").evaluate(
+                WAIT_NEXT_CARD_JS,
+                {"selectors": selectors, "prev": prev_signature, "timeout": timeout_ms},
+                timeout=timeout_ms
+            )
+        except Exception as e:
+            logger.debug(f"Card wait error: {e}")
+            # Страница/iframe недоступны - не крутим цикл вхолостую
+            await asyncio.sleep(1)
+            return None
+    
+    def record_activity(self, action_type: str, card: Optional[dict], details: Optional[dict] = None, ok: bool = True):
+        """Кладёт действие в буфер activity_log (без запроса к БД)"""
+        if not self.activity:
+            return
+        self.activity.add({
+            "client_id": self.client_id,
+            "vk_account_id": self.account_id,
+            "action_type": action_type,
+            "target_profile": card,
+            "result": "success" if ok else "failed",
+            "details": details
+        })
+    
     def stop(self):
         self.running = False
 
 
 class TaskProcessor:
     def __init__(self):
-        self.browser_pool = BrowserPool(settings.max_browsers)
+        self.browser_pool = BrowserPool(
+            settings.max_browsers,
+            shared=settings.shared_browsers,
+            processes=settings.browser_processes,
+            on_session=self._save_session,
+            is_busy=self._bot_busy,
+            on_evict=self._on_evict
+        )
         self.redis_client = None
+        self.task_queue: Optional[ReliableQueue] = None
         self.bots: Dict[str, VKDatingBot] = {}
         self.running = True
+        # Параллельное выполнение задач: задачи одного аккаунта идут строго по очереди,
+        # разных аккаунтов - параллельно, но не больше task_limit одновременно.
+        # Слот берётся прямо перед выполнением (и фоновой сессией свайпов), поэтому
+        # задачи, ждущие за долгой сессией своего аккаунта, слотов не занимают.
+        # Сколько задач вообще забрано из Redis, ограничивает intake.
+        self.task_limit = settings.max_concurrent_tasks or settings.max_browsers
+        self.task_slots = asyncio.Semaphore(self.task_limit)
+        self.intake = asyncio.Semaphore(settings.max_pending_tasks or 4 * self.task_limit)
+        self.swipe_sessions: Set[asyncio.Task] = set()
+        self.account_queues: Dict[str, asyncio.Queue] = {}
+        self.account_runners: Dict[str, asyncio.Task] = {}
+        self.tasks_in_flight = 0
+        self.activity = ActivityBuffer(
+            engine,
+            batch_size=settings.activity_batch_size,
+            flush_interval=settings.activity_flush_interval
+        )
+        self.account_state = AccountStateBuffer(async_session, flush_interval=settings.account_state_flush_interval)
         
     async def start(self):
         self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+        self.account_state.redis = self.redis_client
+        self.task_queue = ReliableQueue(
+            self.redis_client,
+            "task_queue",
+            settings.worker_id,
+            visibility_timeout=settings.task_visibility_timeout,
+            max_attempts=settings.task_max_attempts,
+            retry_backoff=settings.task_retry_backoff,
+            inbox=True
+        )
+        await self.task_queue.register()
+        await self._report_load()
         await self.browser_pool.start()
         
         pubsub = self.redis_client.pubsub()
@@ -494,7 +953,20 @@ class TaskProcessor:
         self.running = False
         for bot in self.bots.values():
             bot.stop()
+        for runner in list(self.account_runners.values()) + list(self.swipe_sessions):
+            runner.cancel()
+        if self.task_queue:
+            # Незавершённые задачи сразу отдаём другим воркерам, не дожидаясь visibility timeout
+            try:
+                moved = await self.task_queue.requeue_inflight()
+                if moved:
+                    logger.info(f"↩️ Returned {moved} unfinished tasks to the queue")
+            except Exception as e:
+                logger.error(f"Requeue error: {e}")
+        await self.activity.close()
+        # Пул сохраняет изменившиеся сессии при закрытии - сбрасываем их после
         await self.browser_pool.stop()
+        await self.account_state.close()
         if self.redis_client:
             await self.redis_client.close()
     
@@ -509,22 +981,124 @@ class TaskProcessor:
                     self.bots[account_id].stop()
                     await self.browser_pool.release(account_id)
                     del self.bots[account_id]
+                    await self._release_account(account_id)
                     logger.info(f"⏹️ Bot stopped for {account_id[:8]}")
+                
+                elif command == "reload_config" and account_id in self.bots:
+                    try:
+                        await self._reload_config(account_id)
+                    except Exception as e:
+                        logger.error(f"Config reload error for {account_id[:8]}: {e}")
+    
+    @staticmethod
+    def _config_from_row(row) -> dict:
+        return {
+            "active_quest": row.active_quest or "ideal_date",
+            # JSON null в старых строках - как пустые фильтры
+            "quest_filters": (json.loads(row.quest_filters) if row.quest_filters else None) or {},
+            "boost_times": row.boost_times
+        }
+    
+    async def _reload_config(self, account_id: str):
+        """Перечитывает bot_configs и подменяет конфиг бота без перезапуска браузера"""
+        async with async_session() as db:
+            result = await db.execute(
+                text("SELECT active_quest, quest_filters, boost_times FROM bot_configs WHERE vk_account_id = :account_id"),
+                {"account_id": account_id}
+            )
+            row = result.fetchone()
+        
+        bot = self.bots.get(account_id)
+        if not row or not bot:
+            return
+        bot.update_config(self._config_from_row(row))
+        logger.info(f"🔄 Config reloaded for {account_id[:8]} (quest={bot.config['active_quest']})")
     
     async def process_queue(self):
         while self.running:
+            # Backpressure: не забираем задачи из Redis, пока взятых и невыполненных слишком много
+            await self.intake.acquire()
+            dispatched = False
             try:
-                result = await self.redis_client.brpop("task_queue", timeout=5)
+                result = await self.task_queue.get(timeout=5)
                 if not result:
                     continue
                     
-                _, task_json = result
-                task = json.loads(task_json)
-                await self._process_task(task)
+                raw, task = result
+                dispatched = await self._dispatch_task(raw, task)
                 
             except Exception as e:
                 logger.error(f"Queue processing error: {e}")
                 await asyncio.sleep(1)
+            finally:
+                if not dispatched:
+                    self.intake.release()
+    
+    async def _dispatch_task(self, raw: str, task: dict) -> bool:
+        """
+        Ставит задачу в очередь аккаунта; False - если очередь аккаунта переполнена
+        и задача отложена в Redis
+        """
+        account_id = task.get("vk_account_id") or ""
+        
+        # stop_session не должен ждать окончания текущей сессии свайпов
+        if task.get("type") == "stop_session" and account_id in self.bots:
+            self.bots[account_id].stop()
+        
+        queue = self.account_queues.get(account_id)
+        if (queue is not None and queue.qsize() >= settings.account_queue_limit
+                and task.get("type") != "stop_session"):
+            logger.warning(f"⏳ Task queue of {account_id[:8]} is full, deferring {task.get('type')}")
+            await self.task_queue.defer(raw, task, settings.account_queue_defer)
+            return False
+        if queue is None:
+            queue = self.account_queues[account_id] = asyncio.Queue()
+            self.account_runners[account_id] = asyncio.create_task(self._run_account_tasks(account_id, queue))
+        queue.put_nowait((raw, task))
+        self.tasks_in_flight += 1
+        return True
+    
+    async def _run_account_tasks(self, account_id: str, queue: asyncio.Queue):
+        """Выполняет задачи одного аккаунта последовательно; слот - только на время выполнения"""
+        try:
+            while not queue.empty():
+                raw, task = queue.get_nowait()
+                try:
+                    async with self.task_slots:
+                        try:
+                            await self._process_task(task)
+                        except Exception as e:
+                            await self._finish_task(raw, task, str(e))
+                        else:
+                            await self._finish_task(raw, task)
+                finally:
+                    self.tasks_in_flight -= 1
+                    self.intake.release()
+        finally:
+            self.account_queues.pop(account_id, None)
+            self.account_runners.pop(account_id, None)
+    
+    async def _run_swipe_session(self, bot: VKDatingBot):
+        """Фоновая сессия свайпов после start_session - тоже под слотом task_slots"""
+        async with self.task_slots:
+            if not bot.running or bot.swiping or bot.page.is_closed():
+                # Бот остановлен или сессию уже запустила задача process_cards
+                return
+            try:
+                await bot.run_swipe_session()
+            except Exception as e:
+                logger.error(f"Swipe session error for {bot.account_id[:8]}: {e}")
+    
+    async def _finish_task(self, raw: str, task: dict, error: Optional[str] = None):
+        """ack при успехе, ретрай/dead-letter при ошибке"""
+        try:
+            if error is None:
+                await self.task_queue.ack(raw)
+            else:
+                await self.task_queue.fail(raw, task, error)
+        except Exception as e:
+            # Задача останется в processing-списке и вернётся в очередь при перезапуске
+            logger.error(f"Task ack error: {e}")
     
     async def _process_task(self, task: dict):
         task_type = task.get("type")
@@ -536,30 +1110,139 @@ class TaskProcessor:
             if task_type == "start_session":
                 await self._handle_start_session(task)
                 
+            elif task_type == "warm_session":
+                await self._handle_warm_session(task)
+                
             elif task_type == "process_cards":
-                if account_id in self.bots:
+                # Прогрев не успел или контекст вытеснен - поднимаем сейчас
+                bot = await self._ensure_bot(task)
+                if bot:
+                    if bot.swiping:
+                        # Сессия, запущенная start_session, ещё идёт на этой же странице
+                        logger.info(f"⏭️ Swipe session already running for {account_id[:8]}")
+                        return
                     max_swipes = task.get("params", {}).get("max_swipes", 50)
-                    await self.bots[account_id].run_swipe_session(max_swipes)
+                    await bot.run_swipe_session(max_swipes)
+                    
+            elif task_type == "activate_boost":
+                # Буст привязан ко времени - ради него поднимаем браузер, но только в свободный слот
+                bot = self._live_bot(account_id) or await self._start_if_capacity(task)
+                if bot:
+                    await bot.activate_boost()
+                else:
+                    logger.info(f"⏭️ Boost skipped for {account_id[:8]}: no live bot and no free browser")
+                    
+            elif task_type == "check_matches":
+                # Периодическая проверка только для живых ботов: холодный старт вытеснял бы свайпающие контексты
+                bot = self._live_bot(account_id)
+                if bot:
+                    if bot.swiping:
+                        # Не уводим страницу со вкладки анкет посреди сессии - проверим в следующий раз
+                        logger.info(f"⏭️ Match check skipped during swipe session for {account_id[:8]}")
+                        return
+                    await self._handle_check_matches(bot)
                     
             elif task_type == "stop_session":
                 if account_id in self.bots:
                     self.bots[account_id].stop()
-                    session_data = await self.browser_pool.release(account_id)
-                    if session_data:
-                        await self._save_session(account_id, session_data)
+                    await self.browser_pool.release(account_id)
                     del self.bots[account_id]
+                    await self._release_account(account_id)
                     
         except Exception as e:
             logger.error(f"Task processing error: {e}")
-            await self._update_account_status(account_id, "error", str(e))
+            if account_id:
+                self._update_account_status(account_id, "error", str(e))
+            raise
+    
+    def _live_bot(self, account_id: str) -> Optional[VKDatingBot]:
+        bot = self.bots.get(account_id)
+        if bot and not bot.page.is_closed():
+            self.browser_pool.touch(account_id)
+            return bot
+        self.bots.pop(account_id, None)
+        return None
+    
+    async def _start_if_capacity(self, task: dict) -> Optional[VKDatingBot]:
+        """Запуск без сессии свайпов, только если пул не придётся вытеснять"""
+        if not self.browser_pool.has_capacity():
+            return None
+        await self._handle_start_session(task, swipe=False)
+        return self.bots.get(task["vk_account_id"])
+    
+    async def _ensure_bot(self, task: dict) -> Optional[VKDatingBot]:
+        """Живой бот аккаунта; без него - запуск без сессии свайпов"""
+        account_id = task["vk_account_id"]
+        bot = self._live_bot(account_id)
+        if bot:
+            return bot
+        await self._handle_start_session(task, swipe=False)
+        return self.bots.get(account_id)
     
-    async def _handle_start_session(self, task: dict):
+    async def _handle_check_matches(self, bot: VKDatingBot):
+        """Новые матчи и чаты - в dialogues одним INSERT, матчи - в activity_log"""
+        people = await bot.check_matches()
+        if not people:
+            return
+        async with async_session() as db:
+            result = await db.execute(
+                text("""
+                    INSERT INTO dialogues (client_id, vk_account_id, target_profile, stage, last_message_at)
+                    SELECT CAST(:client_id AS uuid), CAST(:account_id AS uuid), p.profile,
+                           CASE WHEN p.profile->>'source' = 'chats' THEN 'started' ELSE 'matched' END,
+                           CASE WHEN p.profile->>'source' = 'chats' THEN NOW() END
+                    FROM jsonb_array_elements(CAST(:people AS jsonb)) AS p(profile)
+                    ON CONFLICT (vk_account_id, (target_profile->>'fingerprint')) DO UPDATE
+                        SET stage = 'started', last_message_at = NOW(), target_profile = EXCLUDED.target_profile
+                        WHERE dialogues.stage = 'matched' AND EXCLUDED.stage = 'started'
+                    RETURNING target_profile, (xmax = 0) AS inserted
+                """),
+                {
+                    "client_id": bot.client_id,
+                    "account_id": bot.account_id,
+                    "people": json.dumps(people, ensure_ascii=False)
+                }
+            )
+            rows = result.fetchall()
+            await db.commit()
+        
+        new_matches = 0
+        for row in rows:
+            if row.inserted:
+                profile = json.loads(row.target_profile) if isinstance(row.target_profile, str) else row.target_profile
+                bot.record_activity("match", profile)
+                new_matches += 1
+        bot.stats["matches"] += new_matches
+        logger.info(f"💕 {bot.account_id[:8]}: {len(people)} people scanned, {new_matches} new matches, "
+                    f"{len(rows) - new_matches} chats started")
+    
+    async def _handle_warm_session(self, task: dict):
+        """
+        Прогрев перед плановым окном свайпов: контекст, сессия и открытый vk.com/dating.
+        Только в пределах max_browsers - ради прогрева активные контексты не вытесняются.
+        """
+        account_id = task["vk_account_id"]
+        bot = self.bots.get(account_id)
+        if bot and not bot.page.is_closed():
+            self.browser_pool.touch(account_id)
+            return
+        self.bots.pop(account_id, None)
+        if not self.browser_pool.has_capacity():
+            logger.info(f"🧊 No browser capacity to prefetch {account_id[:8]}, will start cold")
+            return
+        await self._handle_start_session(task, swipe=False)
+        if account_id in self.bots:
+            logger.info(f"🔥 Prefetched {account_id[:8]}")
+    
+    async def _handle_start_session(self, task: dict, swipe: bool = True):
         account_id = task["vk_account_id"]
         
+        # Соединение с БД отдаём до запуска браузера
         async with async_session() as db:
             result = await db.execute(
                 text("""
-                    SELECT va.session_data_encrypted, bc.active_quest, bc.quest_filters, bc.boost_times 
+                    SELECT va.client_id, va.status, va.session_data_encrypted, bc.is_active,
+                           bc.active_quest, bc.quest_filters, bc.boost_times 
                     FROM vk_accounts va 
                     LEFT JOIN bot_configs bc ON va.id = bc.vk_account_id 
                     WHERE va.id = :account_id
@@ -568,64 +1251,109 @@ class TaskProcessor:
             )
             row = result.fetchone()
             
-            if not row:
-                logger.error(f"Account {account_id} not found")
-                return
-            
-            session_data = None
-            if row.session_data_encrypted:
-                try:
-                    session_data = json.loads(row.session_data_encrypted.decode())
-                except:
-                    pass
-            
-            config = {
-                "active_quest": row.active_quest or "ideal_date",
-                "quest_filters": json.loads(row.quest_filters) if row.quest_filters else {},
-                "boost_times": row.boost_times
-            }
-            
-            page = await self.browser_pool.get_or_create(
-                account_id, 
-                session_data, 
-                desktop=settings.use_desktop
-            )
-            bot = VKDatingBot(page, account_id, config, desktop=settings.use_desktop)
-            
-            if await bot.start():
-                self.bots[account_id] = bot
-                await self._update_account_status(account_id, "active")
-                asyncio.create_task(bot.run_swipe_session())
-            else:
-                await self._update_account_status(account_id, "auth_required")
+        if not row:
+            logger.error(f"Account {account_id} not found")
+            return
+        
+        if not swipe and (not row.is_active or row.status in NO_COLD_START_STATUSES):
+            # Задача (process_cards, буст, прогрев) поставлена или отложена до /stop - браузер не поднимаем
+            logger.info(f"⏭️ {task.get('type')} dropped for {account_id[:8]}: bot is off (status={row.status})")
+            return
+        
+        session_data = None
+        try:
+            session_data = decode_session(row.session_data_encrypted, account_id, SESSION_KEY)
+        except ValueError as e:
+            logger.warning(f"Stored session for {account_id[:8]} is unreadable: {e}")
+        
+        config = self._config_from_row(row)
+        
+        page = await self.browser_pool.get_or_create(
+            account_id, 
+            session_data, 
+            desktop=settings.use_desktop
+        )
+        bot = VKDatingBot(
+            page,
+            account_id,
+            config,
+            desktop=settings.use_desktop,
+            client_id=str(row.client_id) if row.client_id else None,
+            activity=self.activity,
+            decisions=DecisionCache(self.redis_client, account_id, ttl=settings.card_cache_ttl)
+        )
+        
+        if await bot.start():
+            self.bots[account_id] = bot
+            # Следующие задачи аккаунта маршрутизируются на этот воркер (тёплый браузер)
+            await self.redis_client.hset("account_worker", account_id, settings.worker_id)
+            self._update_account_status(account_id, "active")
+            if swipe:
+                runner = asyncio.create_task(self._run_swipe_session(bot))
+                self.swipe_sessions.add(runner)
+                runner.add_done_callback(self.swipe_sessions.discard)
+        else:
+            self._update_account_status(account_id, "auth_required")
     
-    async def _update_account_status(self, account_id: str, status: str, error: str = None):
-        async with async_session() as db:
-            if error:
-                await db.execute(
-                    text("UPDATE vk_accounts SET status = :status, error_message = :error, last_active_at = NOW() WHERE id = :id"),
-                    {"id": account_id, "status": status, "error": error}
-                )
-            else:
-                await db.execute(
-                    text("UPDATE vk_accounts SET status = :status, error_message = NULL, last_active_at = NOW() WHERE id = :id"),
-                    {"id": account_id, "status": status}
-                )
-            await db.commit()
+    def _bot_busy(self, account_id: str) -> bool:
+        bot = self.bots.get(account_id)
+        return bool(bot and bot.swiping)
     
-    async def _save_session(self, account_id: str, session_data: dict):
-        async with async_session() as db:
-            await db.execute(
-                text("UPDATE vk_accounts SET session_data_encrypted = :session WHERE id = :id"),
-                {"id": account_id, "session": json.dumps(session_data).encode()}
-            )
-            await db.commit()
+    def _on_evict(self, account_id: str):
+        """Контекст аккаунта вытесняется из пула - его бот больше не может работать"""
+        bot = self.bots.pop(account_id, None)
+        if bot:
+            bot.stop()
+            logger.info(f"♻️ Bot {account_id[:8]} stopped: browser context evicted")
+    
+    def _update_account_status(self, account_id: str, status: str, error: str = None):
+        """Пишется в vk_accounts со следующим пакетным сбросом account_state"""
+        self.account_state.set_status(account_id, status, error)
+    
+    def _save_session(self, account_id: str, session_data: dict):
+        self.account_state.save_session(account_id, encode_session(session_data, account_id, SESSION_KEY))
+    
+    async def persist_sessions(self):
+        """Периодически сохраняет сессии с изменившимися cookies (переживают падение воркера)"""
+        while self.running:
+            await asyncio.sleep(settings.session_persist_interval)
+            try:
+                saved = await self.browser_pool.persist_sessions()
+                if saved:
+                    logger.info(f"💾 Persisted {saved} changed sessions")
+            except Exception as e:
+                logger.error(f"Session persist error: {e}")
+    
+    async def maintain_queue(self):
+        """Продлевает lease воркера, запускает ретраи и забирает задачи упавших воркеров"""
+        interval = max(5, settings.task_visibility_timeout // 3)
+        while self.running:
+            try:
+                await self.task_queue.maintain()
+            except Exception as e:
+                logger.error(f"Queue maintenance error: {e}")
+            await asyncio.sleep(interval)
+    
+    async def _release_account(self, account_id: str):
+        """Снимает affinity аккаунта, если он закреплён за этим воркером"""
+        if await self.redis_client.hget("account_worker", account_id) == settings.worker_id:
+            await self.redis_client.hdel("account_worker", account_id)
+    
+    async def _report_load(self):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset("worker_load", settings.worker_id, len(self.bots))
+            pipe.hset("worker_capacity", settings.worker_id, settings.max_browsers)
+            await pipe.execute()
     
     async def report_status(self):
         while self.running:
             status = self.browser_pool.get_status()
-            await self.redis_client.hset("worker_load", settings.worker_id, len(self.bots))
-            logger.info(f"📊 Status: {status['active_browsers']}/{status['max_browsers']} browsers, {len(self.bots)} bots")
+            await self._report_load()
+            for account_id in self.bots:
+                self.account_state.heartbeat(account_id)
+            logger.info(f"📊 Status: {status['active_browsers']}/{status['max_browsers']} browsers, {len(self.bots)} bots, "
+                        f"{self.task_limit - self.task_slots._value}/{self.task_limit} slots busy, "
+                        f"{self.tasks_in_flight} tasks taken, {len(self.swipe_sessions)} swipe sessions")
             await asyncio.sleep(60)
 
 
@@ -635,6 +1363,10 @@ async def main():
         await processor.start()
         await asyncio.gather(
             processor.process_queue(),
+            processor.maintain_queue(),
+            processor.activity.run(),
+            processor.account_state.run(),
+            processor.persist_sessions(),
             processor.report_status()
         )
     except KeyboardInterrupt:
@@ -3,7 +3,9 @@ Dating Bot Platform - Scheduler
 """
 import os
 import json
+import time
 import asyncio
+import hashlib
 import logging
 from datetime import datetime
 
@@ -14,6 +16,10 @@ from pydantic_settings import BaseSettings
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy import text
 
+from task_queue import route_tasks
+from boost_timeline import BoostTimeline
+from active_accounts import ActiveAccounts, ACCOUNT_STATUS_CHANNEL
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,17 @@ logger = logging.getLogger(__name__)
 class Settings(BaseSettings):
     database_url: str
     redis_url: str
+    activity_log_retention_days: int = 180
+    prefetch_lead_minutes: int = 2  # За сколько минут до окна свайпов прогревать браузеры
+    # True: у каждого аккаунта свой детерминированный сдвиг внутри swipe_interval_minutes,
+    # задачи раздаются каждую минуту небольшими порциями. False: все аккаунты на общих cron-тиках
+    spread_schedule: bool = True
+    match_check_interval_minutes: int = 10
+    enqueue_batch_size: int = 500  # Задач в одном pipeline при постановке в очередь
+    boost_max_lateness: int = 300  # Буст, опоздавший больше чем на столько секунд (простой планировщика), пропускается
+    boost_sync_interval_minutes: int = 15  # Пересверка таймлайна бустов с активными аккаунтами
+    active_reconcile_minutes: int = 5  # Сверка активных аккаунтов в памяти с БД по контрольной сумме
+    spread_catchup_minutes: int = 60  # Сколько пропущенных минут раздачи догонять после простоя
     class Config:
         env_file = ".env"
 
@@ -30,66 +47,262 @@ engine = create_async_engine(DATABASE_URL, echo=False)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+# Последняя минута, за которую раздача уже выполнена (unix-время начала минуты)
+SPREAD_CURSOR = "spread_dispatch:last_minute"
+
+# Статусы, при которых аккаунту ставятся задачи / бусты
+RUNNING_STATUSES = ("active",)
+BOOST_STATUSES = ("active", "starting")
+
+
+def phase_offset(key: str, period: int) -> int:
+    """Детерминированный сдвиг ключа внутри периода, секунды (одинаковый во всех процессах)"""
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % period
+
+
+def is_due(key: str, period: int, minute_start: int) -> bool:
+    """Попадает ли запуск ключа (phase + k * period) в минуту [minute_start, minute_start + 60)"""
+    return (phase_offset(key, period) - minute_start) % period < 60
+
+
 class TaskScheduler:
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
         self.redis_client = None
+        self.boosts: BoostTimeline = None
+        self.active = ActiveAccounts(async_session)
+        self.background: list = []
         
     async def start(self):
         self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+        self.boosts = BoostTimeline(self.redis_client)
+        # Подписка до загрузки: события, пришедшие во время load(), не теряются
+        pubsub = self.redis_client.pubsub()
+        await pubsub.psubscribe("control:*")
+        await pubsub.subscribe(ACCOUNT_STATUS_CHANNEL)
+        await self.active.load()
+        await self.sync_boost_timeline()
+        # Партиции на текущий месяц должны быть до первой записи, а не только после 03:15
+        try:
+            await self.maintain_activity_log()
+        except Exception as e:
+            logger.error(f"activity_log maintenance at startup failed: {e}")
+        self.background = [
+            asyncio.create_task(self.dispatch_boosts()),
+            asyncio.create_task(self.listen_account_changes(pubsub))
+        ]
         
-        self.scheduler.add_job(self.schedule_boosts, CronTrigger(minute="*/5"), id="check_boosts")
-        self.scheduler.add_job(self.schedule_swipe_sessions, CronTrigger(minute="*/30"), id="schedule_swipes")
-        self.scheduler.add_job(self.schedule_match_checks, CronTrigger(minute="*/10"), id="check_matches")
+        self.scheduler.add_job(
+            self.sync_boost_timeline,
+            CronTrigger(minute=f"*/{settings.boost_sync_interval_minutes}"),
+            id="sync_boosts"
+        )
+        self.scheduler.add_job(
+            self.reconcile_active_accounts,
+            CronTrigger(minute=f"*/{settings.active_reconcile_minutes}"),
+            id="reconcile_active"
+        )
+        if settings.spread_schedule:
+            # Опоздавший или пропущенный запуск не теряет минуты - их догоняет курсор в Redis
+            self.scheduler.add_job(
+                self.dispatch_spread_tasks,
+                CronTrigger(minute="*"),
+                id="spread_dispatch",
+                coalesce=True,
+                misfire_grace_time=60
+            )
+        else:
+            self.scheduler.add_job(self.schedule_swipe_sessions, CronTrigger(minute="*/30"), id="schedule_swipes")
+            prefetch_minutes = ",".join(str((m - settings.prefetch_lead_minutes) % 60) for m in (0, 30))
+            self.scheduler.add_job(self.prefetch_swipe_sessions, CronTrigger(minute=prefetch_minutes), id="prefetch_swipes")
+            self.scheduler.add_job(self.schedule_match_checks, CronTrigger(minute="*/10"), id="check_matches")
         self.scheduler.add_job(self.cleanup_stale_sessions, CronTrigger(hour="*/1"), id="cleanup")
+        self.scheduler.add_job(self.maintain_activity_log, CronTrigger(hour=3, minute=15), id="activity_log_partitions")
         
         self.scheduler.start()
         logger.info("✅ Scheduler started")
         
     async def stop(self):
         self.scheduler.shutdown()
+        for task in self.background:
+            task.cancel()
         if self.redis_client:
             await self.redis_client.close()
     
-    async def schedule_boosts(self):
-        now = datetime.now()
-        async with async_session() as db:
-            result = await db.execute(text("SELECT bc.vk_account_id, bc.boost_times FROM bot_configs bc JOIN vk_accounts va ON bc.vk_account_id = va.id WHERE bc.is_active = true AND va.status = 'active'"))
-            for row in result.fetchall():
-                boost_times = row.boost_times or []
-                for boost_time in boost_times:
+    async def sync_boost_timeline(self):
+        """Сверка таймлайна бустов с активными аккаунтами в памяти"""
+        configs = {a.id: (a.boost_times, a.boost_timezone) for a in self.active.with_status(*BOOST_STATUSES)}
+        changed = await self.boosts.sync(configs, time.time())
+        if changed:
+            logger.info(f"🗓️ Boost timeline synced: {changed} entries updated")
+    
+    async def reconcile_active_accounts(self):
+        """Дешёвая сверка по контрольной сумме; при расхождении - перезагрузка и пересверка бустов"""
+        if await self.active.reconcile():
+            await self.sync_boost_timeline()
+    
+    async def dispatch_boosts(self):
+        """
+        Ставит наступившие бусты из таймлайна; спит до ближайшего, но не дольше секунды.
+        Записи передвигаются на следующий буст только после успешной постановки задач.
+        """
+        while True:
+            try:
+                now = time.time()
+                due = await self.boosts.due(now)
+                if due:
+                    tasks = []
+                    for account_id, fire_at in due:
+                        if now - fire_at > settings.boost_max_lateness:
+                            logger.warning(f"⏰ Boost for {account_id[:8]} is {int(now - fire_at)}s late, skipped")
+                            continue
+                        tasks.append({
+                            "type": "activate_boost",
+                            "vk_account_id": account_id,
+                            "fire_at": datetime.utcfromtimestamp(fire_at).isoformat(),
+                            "timestamp": datetime.utcnow().isoformat()
+                        })
+                    await route_tasks(self.redis_client, tasks, batch_size=settings.enqueue_batch_size)
+                    await self.boosts.advance(due, now)
+                    if tasks:
+                        logger.info(f"🚀 Dispatched {len(tasks)} boosts")
+                next_at = await self.boosts.next_due()
+                delay = 1.0 if next_at is None else min(1.0, max(0.0, next_at - time.time()))
+            except Exception as e:
+                logger.error(f"Boost dispatch error: {e}")
+                delay = 5.0
+            await asyncio.sleep(delay)
+    
+    async def _update_boosts(self, account_id: str):
+        account = self.active.accounts.get(account_id)
+        if account and account.status in BOOST_STATUSES:
+            await self.boosts.schedule(account_id, account.boost_times, account.boost_timezone, time.time())
+        else:
+            await self.boosts.remove(account_id)
+    
+    async def listen_account_changes(self, pubsub):
+        """
+        Поддерживает активные аккаунты и таймлайн бустов по событиям:
+        control:<аккаунт> от API и account_status от воркеров
+        """
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "pmessage":
+                    account_id = message["channel"].split(":")[-1]
+                    command = message["data"]
+                elif message["type"] == "message":
                     try:
-                        bt_hour, bt_min = map(int, boost_time.split(":"))
-                        diff = abs(now.hour * 60 + now.minute - bt_hour * 60 - bt_min)
-                        if diff <= 2:
-                            task = {"type": "activate_boost", "vk_account_id": str(row.vk_account_id), "timestamp": now.isoformat()}
-                            await self.redis_client.lpush("task_queue", json.dumps(task))
-                            logger.info(f"🚀 Scheduled boost for {str(row.vk_account_id)[:8]}...")
-                            break
-                    except ValueError:
+                        event = json.loads(message["data"])
+                        account_id, command = event["id"], f"status:{event['status']}"
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                else:
+                    continue
+                try:
+                    if command == "stop":
+                        self.active.remove(account_id)
+                    elif command in ("start", "reload_config"):
+                        await self.active.refresh(account_id)
+                    elif command.startswith("status:"):
+                        await self.active.set_status(account_id, command.split(":", 1)[1])
+                    else:
                         continue
+                    await self._update_boosts(account_id)
+                except Exception as e:
+                    logger.error(f"Account update error for {account_id[:8]}: {e}")
+        finally:
+            await pubsub.punsubscribe("control:*")
+            await pubsub.unsubscribe(ACCOUNT_STATUS_CHANNEL)
+            await pubsub.aclose()
+    
+    async def dispatch_spread_tasks(self):
+        """
+        Каждую минуту ставит задачи только тем аккаунтам, чей сдвиг попал в эту минуту:
+        свайпы раз в swipe_interval_minutes, прогрев за prefetch_lead_minutes до них,
+        проверка матчей раз в match_check_interval_minutes.
+        Обрабатываются все минуты после SPREAD_CURSOR (не больше spread_catchup_minutes),
+        поэтому опоздавший или пропущенный запуск не оставляет аккаунты без задач на целый интервал.
+        """
+        now_minute = int(time.time()) // 60 * 60
+        last = await self.redis_client.get(SPREAD_CURSOR)
+        first = int(last) + 60 if last else now_minute
+        first = max(first, now_minute - (settings.spread_catchup_minutes - 1) * 60)
+        if first > now_minute:
+            return
+        minutes = range(first, now_minute + 60, 60)
+        match_period = max(1, settings.match_check_interval_minutes) * 60
+        timestamp = datetime.utcnow().isoformat()
+        
+        accounts = self.active.with_status(*RUNNING_STATUSES)
+        tasks = []
+        for account in accounts:
+            account_id = account.id
+            period = max(1, account.swipe_interval_minutes or 30) * 60
+            # Одна задача каждого типа на аккаунт, даже если за пропущенные минуты их набралось несколько
+            due = set()
+            for minute_start in minutes:
+                if settings.prefetch_lead_minutes and is_due(account_id, period, minute_start + settings.prefetch_lead_minutes * 60):
+                    due.add("warm_session")
+                if is_due(account_id, period, minute_start):
+                    due.add("process_cards")
+                if is_due(f"{account_id}:matches", match_period, minute_start):
+                    due.add("check_matches")
+            if "warm_session" in due:
+                tasks.append({"type": "warm_session", "vk_account_id": account_id, "timestamp": timestamp})
+            if "process_cards" in due:
+                tasks.append({"type": "process_cards", "vk_account_id": account_id, "params": {"max_swipes": 30}, "timestamp": timestamp})
+            if "check_matches" in due:
+                tasks.append({"type": "check_matches", "vk_account_id": account_id, "timestamp": timestamp})
+        
+        queued = await route_tasks(self.redis_client, tasks, batch_size=settings.enqueue_batch_size)
+        # Курсор двигается только после успешной постановки: при ошибке минуты повторятся
+        await self.redis_client.set(SPREAD_CURSOR, now_minute)
+        if len(minutes) > 1:
+            logger.warning(f"⏱️ Spread dispatch caught up {len(minutes) - 1} missed minutes")
+        if queued:
+            logger.info(f"📋 Dispatched {queued} spread tasks for {len(accounts)} active accounts")
+    
+    async def _enqueue_for_running(self, task_type: str, **extra) -> int:
+        timestamp = datetime.utcnow().isoformat()
+        tasks = [
+            {"type": task_type, "vk_account_id": account.id, **extra, "timestamp": timestamp}
+            for account in self.active.with_status(*RUNNING_STATUSES)
+        ]
+        return await route_tasks(self.redis_client, tasks, batch_size=settings.enqueue_batch_size)
     
     async def schedule_swipe_sessions(self):
-        async with async_session() as db:
-            result = await db.execute(text("SELECT bc.vk_account_id FROM bot_configs bc JOIN vk_accounts va ON bc.vk_account_id = va.id WHERE bc.is_active = true AND va.status = 'active'"))
-            for row in result.fetchall():
-                task = {"type": "process_cards", "vk_account_id": str(row.vk_account_id), "params": {"max_swipes": 30}, "timestamp": datetime.utcnow().isoformat()}
-                await self.redis_client.lpush("task_queue", json.dumps(task))
+        await self._enqueue_for_running("process_cards", params={"max_swipes": 30})
         logger.info("📋 Scheduled swipe sessions")
     
+    async def prefetch_swipe_sessions(self):
+        """Прогрев контекстов до окна свайпов, чтобы в момент окна не стартовать все браузеры разом"""
+        queued = await self._enqueue_for_running("warm_session")
+        logger.info(f"🔥 Prefetch requested for {queued} accounts")
+    
     async def schedule_match_checks(self):
-        async with async_session() as db:
-            result = await db.execute(text("SELECT va.id FROM vk_accounts va JOIN bot_configs bc ON va.id = bc.vk_account_id WHERE bc.is_active = true AND va.status = 'active'"))
-            for row in result.fetchall():
-                task = {"type": "check_matches", "vk_account_id": str(row.id), "timestamp": datetime.utcnow().isoformat()}
-                await self.redis_client.lpush("task_queue", json.dumps(task))
+        await self._enqueue_for_running("check_matches")
         logger.info("💕 Scheduled match checks")
     
     async def cleanup_stale_sessions(self):
         async with async_session() as db:
-            await db.execute(text("UPDATE vk_accounts SET status = 'inactive' WHERE status = 'active' AND last_active_at < NOW() - INTERVAL '2 hours'"))
+            result = await db.execute(text("UPDATE vk_accounts SET status = 'inactive' WHERE status = 'active' AND last_active_at < NOW() - INTERVAL '2 hours' RETURNING id"))
+            stale = [str(row.id) for row in result.fetchall()]
+            await db.commit()
+        for account_id in stale:
+            await self.active.set_status(account_id, "inactive")
+            await self._update_boosts(account_id)
+        logger.info(f"🧹 Cleaned up {len(stale)} stale sessions")
+    
+    async def maintain_activity_log(self):
+        """Создаёт партиции activity_log наперёд и удаляет старше срока хранения"""
+        async with async_session() as db:
+            await db.execute(
+                text("SELECT manage_activity_log_partitions(make_interval(days => :days))"),
+                {"days": settings.activity_log_retention_days}
+            )
             await db.commit()
-        logger.info("🧹 Cleaned up stale sessions")
+        logger.info(f"🗂️ activity_log partitions maintained (retention {settings.activity_log_retention_days}d)")
 
 
 async def main():
@@ -0,0 +1,170 @@
+"""
+Движок оценки карточек по квестам
+
+quest_filters аккаунта компилируется один раз в два регулярных выражения
+(позитивные и негативные ключевые слова) с весами. Ключевые слова
+приводятся к основе (ё -> е, отсечение русских окончаний), поэтому
+"путешествия" находит и "путешествие", и "путешествовать".
+Скомпилированный скорер кешируется по версии конфига (хеш квеста и фильтров).
+"""
+import re
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Ключевые слова квестов по умолчанию: (слова, вес, подпись причины)
+QUEST_KEYWORDS = {
+    "ideal_date": (["путешествия", "музыка", "кино", "спорт"], 15, "интерес"),
+    "investor": (["инвестор", "бизнес", "стартап", "ceo", "founder", "предприниматель", "директор"], 40, "бизнес"),
+    "creative": (["художник", "музыкант", "дизайнер", "фотограф", "творческ", "искусств"], 30, "творчество"),
+}
+
+NEGATIVE_WEIGHT = -100
+
+# Окончания, от длинных к коротким
+RU_ENDINGS = sorted([
+    "иями", "ями", "ами", "ией", "ием", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ия", "ие", "ий", "ья", "ье", "ой", "ей", "ый", "ая", "яя", "ое", "ее", "ые",
+    "ов", "ев", "ам", "ям", "ах", "ях", "ом", "ем", "ую", "юю",
+    "а", "я", "ы", "и", "о", "е", "у", "ю", "ь"
+], key=len, reverse=True)
+MIN_STEM = 4
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+SCORER_CACHE_SIZE = 256
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    """Грубая основа русского слова; латиница и короткие слова не трогаются"""
+    word = normalize(word).strip()
+    if " " in word or not CYRILLIC_RE.search(word):
+        return word
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+class KeywordMatcher:
+    """Одно регулярное выражение на все основы: r'\b(основа1|основа2|...)\w*'"""
+
+    def __init__(self, keywords: Dict[str, Tuple[int, str]]):
+        # основа -> [(исходное слово, вес, подпись)]
+        self.terms: Dict[str, List[Tuple[str, int, str]]] = {}
+        for keyword, (weight, label) in keywords.items():
+            self.terms.setdefault(stem(keyword), []).append((keyword, weight, label))
+
+        self.pattern: Optional[re.Pattern] = None
+        if self.terms:
+            alternation = "|".join(re.escape(s) for s in sorted(self.terms, key=len, reverse=True))
+            self.pattern = re.compile(rf"\b({alternation})\w*")
+
+    def find(self, text: str) -> List[Tuple[str, int, str]]:
+        """Совпавшие ключевые слова (каждое не больше одного раза)"""
+        if not self.pattern or not text:
+            return []
+        found = []
+        seen = set()
+        for match in self.pattern.finditer(text):
+            key = match.group(1)
+            if key in seen:
+                continue
+            seen.add(key)
+            found.extend(self.terms[key])
+        return found
+
+
+class QuestScorer:
+    def __init__(self, quest: str, filters: dict, version: Optional[str] = None):
+        self.quest = quest
+        self.version = version
+        self.min_age = filters.get("min_age", 18)
+        self.max_age = filters.get("max_age", 100)
+        self.min_score = filters.get("min_score", 20)
+        self.superlike_score = filters.get("superlike_score", 60)
+
+        positive: Dict[str, Tuple[int, str]] = {}
+        if quest in QUEST_KEYWORDS:
+            defaults, weight, label = QUEST_KEYWORDS[quest]
+            # Для ideal_date список интересов задаётся клиентом
+            words = filters.get("interests", defaults) if quest == "ideal_date" else defaults
+            for word in words:
+                positive[word] = (weight, label)
+        # Дополнительные веса: {"keyword_weights": {"яхта": 25}}
+        for word, weight in (filters.get("keyword_weights") or {}).items():
+            positive[word] = (int(weight), "ключевое слово")
+
+        negative = {word: (NEGATIVE_WEIGHT, "негатив") for word in filters.get("negative_keywords", [])}
+
+        self.positive = KeywordMatcher(positive)
+        self.negative = KeywordMatcher(negative)
+
+    def score(self, card: dict) -> dict:
+        score = 0
+        reasons = []
+
+        age = card.get("age", 0)
+        bio = normalize(card.get("bio") or "")
+        extra = " ".join(
+            (card.get("info") or []) + (card.get("interests") or []) + [card.get("looking_for") or ""]
+        )
+        text = bio + " " + normalize(extra)
+
+        # Фильтр по возрасту
+        if self.min_age <= age <= self.max_age:
+            score += 10
+            reasons.append(f"возраст {age} ок")
+        elif age > 0:
+            score -= 50
+            reasons.append(f"возраст {age} вне диапазона")
+
+        for keyword, weight, label in self.positive.find(text):
+            score += weight
+            reasons.append(f"{label}: {keyword}")
+
+        # Негативные слова ищутся только в описании
+        for keyword, weight, label in self.negative.find(bio):
+            score += weight
+            reasons.append(f"{label}: {keyword}")
+
+        return {
+            "like": score >= self.min_score,
+            "superlike": score >= self.superlike_score,
+            "score": score,
+            "reasons": reasons
+        }
+
+    def score_many(self, cards: List[dict]) -> List[dict]:
+        return [self.score(card) for card in cards]
+
+
+_scorers: "OrderedDict[str, QuestScorer]" = OrderedDict()
+
+
+def config_version(config: dict) -> str:
+    payload = json.dumps(
+        {"quest": config.get("active_quest", "ideal_date"), "filters": config.get("quest_filters", {})},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def get_scorer(config: dict) -> QuestScorer:
+    """Скомпилированный скорер для конфига бота (LRU по версии конфига)"""
+    version = config_version(config)
+    scorer = _scorers.get(version)
+    if scorer is None:
+        scorer = QuestScorer(config.get("active_quest", "ideal_date"), config.get("quest_filters", {}), version)
+        _scorers[version] = scorer
+        if len(_scorers) > SCORER_CACHE_SIZE:
+            _scorers.popitem(last=False)
+    else:
+        _scorers.move_to_end(version)
+    return scorer
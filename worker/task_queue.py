@@ -0,0 +1,392 @@
+"""
+Надёжная очередь задач поверх Redis (at-least-once)
+
+Продюсеры (API, планировщик) делают LPUSH в список очереди.
+Воркер забирает задачу через BLMOVE в свой processing-список и удаляет её
+оттуда только после ack. Пока воркер жив, он продлевает lease-ключ;
+если lease истёк (воркер упал или убит OOM), его processing-список
+возвращается в очередь другим воркером.
+
+Маршрутизация (route_task): задача аккаунта идёт во входящую очередь воркера,
+который уже держит браузер аккаунта (account_worker), иначе - наименее
+загруженному живому воркеру по worker_load / worker_capacity. Если живых
+воркеров нет, задача попадает в общую очередь, которую читают все.
+route_tasks делает то же для пачки задач за несколько pipeline-запросов.
+Созревшие ретраи и отложенные задачи маршрутизируются так же - во входящую
+очередь воркера-владельца, пока его lease жив.
+
+Ключи для очереди `task_queue` и воркера `worker-1`:
+    task_queue                       - общая очередь
+    task_queue:inbox:worker-1        - входящая очередь воркера
+    task_queue:processing:worker-1   - задачи, взятые воркером
+    task_queue:lease:worker-1        - lease воркера (TTL = visibility timeout)
+    task_queue:consumers             - множество воркеров очереди
+    task_queue:delayed               - ретраи с backoff (ZSET, score = время запуска)
+    task_queue:dead                  - dead-letter список
+    account_worker                   - HASH аккаунт -> воркер (affinity)
+    worker_load / worker_capacity    - HASH воркер -> число ботов / max_browsers
+"""
+import json
+import time
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Переносит созревшие ретраи из delayed в голову очереди (конец, с которого читают воркеры)
+PROMOTE_DELAYED = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+    redis.call('RPUSH', KEYS[2], item)
+end
+return #items
+"""
+
+# Забирает созревшие ретраи для маршрутизации по воркерам (очереди с inbox)
+POP_DELAYED = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+end
+return items
+"""
+
+
+async def enqueue_task(redis_client, task: dict, queue: str = "task_queue") -> str:
+    """Кладёт задачу в очередь, присваивая ей id для ack/ретраев"""
+    task.setdefault("id", str(uuid.uuid4()))
+    task.setdefault("attempts", 0)
+    await redis_client.lpush(queue, json.dumps(task))
+    return task["id"]
+
+
+def worker_inbox(worker_id: str, queue: str = "task_queue") -> str:
+    return f"{queue}:inbox:{worker_id}"
+
+
+async def live_workers(redis_client, queue: str = "task_queue") -> list:
+    """Воркеры с живым lease"""
+    workers = list(await redis_client.hkeys("worker_capacity"))
+    if not workers:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for worker_id in workers:
+            pipe.exists(f"{queue}:lease:{worker_id}")
+        alive = await pipe.execute()
+    return [w for w, ok in zip(workers, alive) if ok]
+
+
+def _least_loaded(loads: Dict[str, int], capacities: Dict[str, int]) -> str:
+    """Свободные воркеры в приоритете; если заполнены все - наименее перегруженный"""
+    free = [w for w in loads if loads[w] < capacities[w]]
+    return min(free or list(loads), key=lambda w: loads[w] / max(1, capacities[w]))
+
+
+async def pick_worker(redis_client, account_id: Optional[str], queue: str = "task_queue") -> Optional[str]:
+    """Воркер, уже держащий аккаунт, иначе наименее загруженный живой воркер"""
+    if account_id:
+        owner = await redis_client.hget("account_worker", account_id)
+        if owner and await redis_client.exists(f"{queue}:lease:{owner}"):
+            return owner
+
+    workers = await live_workers(redis_client, queue)
+    if not workers:
+        return None
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hmget("worker_load", workers)
+        pipe.hmget("worker_capacity", workers)
+        loads, capacities = await pipe.execute()
+
+    worker_id = _least_loaded(
+        {w: int(l or 0) for w, l in zip(workers, loads)},
+        {w: int(c or 1) for w, c in zip(workers, capacities)}
+    )
+
+    if account_id:
+        # Фиксируем affinity сразу, чтобы следующие задачи аккаунта пошли туда же,
+        # и учитываем новый аккаунт в нагрузке до следующего отчёта воркера
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset("account_worker", account_id, worker_id)
+            pipe.hincrby("worker_load", worker_id, 1)
+            await pipe.execute()
+    return worker_id
+
+
+async def route_task(redis_client, task: dict, queue: str = "task_queue") -> str:
+    """Кладёт задачу во входящую очередь подходящего воркера (или в общую)"""
+    worker_id = await pick_worker(redis_client, task.get("vk_account_id"), queue)
+    target = worker_inbox(worker_id, queue) if worker_id else queue
+    return await enqueue_task(redis_client, task, target)
+
+
+async def route_tasks(
+    redis_client,
+    tasks: List[dict],
+    queue: str = "task_queue",
+    batch_size: int = 500,
+    head: bool = False
+) -> int:
+    """
+    Маршрутизирует пачку задач так же, как route_task, но без запросов на каждую задачу:
+    affinity и нагрузка читаются одним pipeline, выбор воркера - в памяти,
+    LPUSH и обновления affinity уходят pipeline'ами по batch_size.
+    head=True - в голову очереди (RPUSH), как ретраи.
+    """
+    if not tasks:
+        return 0
+    account_ids = sorted({t["vk_account_id"] for t in tasks if t.get("vk_account_id")})
+    workers = await live_workers(redis_client, queue)
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        if account_ids:
+            pipe.hmget("account_worker", account_ids)
+        if workers:
+            pipe.hmget("worker_load", workers)
+            pipe.hmget("worker_capacity", workers)
+        results = await pipe.execute()
+
+    owners = dict(zip(account_ids, results.pop(0))) if account_ids else {}
+    loads: Dict[str, int] = {}
+    capacities: Dict[str, int] = {}
+    if workers:
+        loads = {w: int(l or 0) for w, l in zip(workers, results[0])}
+        capacities = {w: int(c or 1) for w, c in zip(workers, results[1])}
+
+    assigned: Dict[str, str] = {}
+    pushes = []
+    for task in tasks:
+        task.setdefault("id", str(uuid.uuid4()))
+        task.setdefault("attempts", 0)
+        account_id = task.get("vk_account_id")
+        worker_id = owners.get(account_id) if account_id else None
+        if worker_id not in loads:
+            worker_id = _least_loaded(loads, capacities) if loads else None
+            if worker_id and account_id:
+                owners[account_id] = assigned[account_id] = worker_id
+                loads[worker_id] += 1
+        pushes.append((worker_inbox(worker_id, queue) if worker_id else queue, json.dumps(task)))
+
+    # Affinity фиксируется до постановки задач, как в pick_worker
+    if assigned:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset("account_worker", mapping=assigned)
+            for worker_id in assigned.values():
+                pipe.hincrby("worker_load", worker_id, 1)
+            await pipe.execute()
+
+    for start in range(0, len(pushes), batch_size):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for target, raw in pushes[start:start + batch_size]:
+                if head:
+                    pipe.rpush(target, raw)
+                else:
+                    pipe.lpush(target, raw)
+            await pipe.execute()
+    return len(pushes)
+
+
+class ReliableQueue:
+    """Потребитель очереди с ack, visibility timeout, ретраями и dead-letter"""
+
+    def __init__(
+        self,
+        redis_client,
+        name: str,
+        consumer_id: str,
+        visibility_timeout: int = 300,
+        max_attempts: int = 5,
+        retry_backoff: int = 10,
+        inbox: bool = False
+    ):
+        self.redis = redis_client
+        self.name = name
+        self.consumer_id = consumer_id
+        # Входящая очередь воркера (маршрутизированные задачи); читается раньше общей
+        self.inbox = worker_inbox(consumer_id, name) if inbox else None
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self.processing_key = self._processing_key(consumer_id)
+        self.consumers_key = f"{name}:consumers"
+        self.delayed_key = f"{name}:delayed"
+        self.dead_key = f"{name}:dead"
+        self._promote = redis_client.register_script(PROMOTE_DELAYED)
+        self._pop_delayed = redis_client.register_script(POP_DELAYED)
+
+    def _processing_key(self, consumer_id: str) -> str:
+        return f"{self.name}:processing:{consumer_id}"
+
+    def _lease_key(self, consumer_id: str) -> str:
+        return f"{self.name}:lease:{consumer_id}"
+
+    async def register(self):
+        """Регистрирует воркер и возвращает в очередь задачи его прошлого запуска"""
+        await self.heartbeat()
+        await self.redis.sadd(self.consumers_key, self.consumer_id)
+        stale_key = f"{self.processing_key}:stale"
+        recovered = await self._reclaim(stale_key, self.consumer_id)
+        if await self.redis.exists(self.processing_key):
+            await self.redis.rename(self.processing_key, stale_key)
+            recovered += await self._reclaim(stale_key, self.consumer_id)
+        if recovered:
+            logger.warning(f"♻️ Recovered {recovered} unacked tasks from previous run of {self.consumer_id}")
+
+    async def heartbeat(self):
+        await self.redis.set(self._lease_key(self.consumer_id), int(time.time()), ex=self.visibility_timeout)
+
+    async def get(self, timeout: int = 5) -> Optional[Tuple[str, dict]]:
+        """Забирает задачу в processing-список. Возвращает (raw, task) или None"""
+        if self.inbox:
+            raw = await self.redis.blmove(self.inbox, self.processing_key, timeout, "RIGHT", "LEFT")
+            if raw is None:
+                raw = await self.redis.lmove(self.name, self.processing_key, "RIGHT", "LEFT")
+        else:
+            raw = await self.redis.blmove(self.name, self.processing_key, timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        try:
+            return raw, json.loads(raw)
+        except ValueError:
+            logger.error(f"☠️ Malformed task moved to {self.dead_key}: {raw[:200]}")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(self.processing_key, 1, raw)
+                pipe.lpush(self.dead_key, raw)
+                await pipe.execute()
+            return None
+
+    async def ack(self, raw: str):
+        await self.redis.lrem(self.processing_key, 1, raw)
+
+    async def defer(self, raw: str, task: dict, delay: float):
+        """Откладывает задачу без траты попытки (воркер перегружен)"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, raw)
+            pipe.zadd(self.delayed_key, {raw: time.time() + delay})
+            await pipe.execute()
+
+    async def fail(self, raw: str, task: dict, error: str):
+        """Ретрай с экспоненциальным backoff или dead-letter после max_attempts"""
+        task = dict(task)
+        task["attempts"] = task.get("attempts", 0) + 1
+        task["last_error"] = error[:500]
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, raw)
+            if task["attempts"] >= self.max_attempts:
+                task["failed_at"] = datetime.utcnow().isoformat()
+                pipe.lpush(self.dead_key, json.dumps(task))
+            else:
+                delay = self.retry_backoff * 2 ** (task["attempts"] - 1)
+                pipe.zadd(self.delayed_key, {json.dumps(task): time.time() + delay})
+            await pipe.execute()
+
+        if task["attempts"] >= self.max_attempts:
+            logger.error(f"☠️ Task {task.get('type')} moved to dead-letter after {task['attempts']} attempts: {error}")
+        else:
+            logger.warning(f"🔁 Task {task.get('type')} will be retried (attempt {task['attempts']}/{self.max_attempts})")
+
+    async def requeue_inflight(self):
+        """Возвращает незавершённые задачи в очередь при штатной остановке"""
+        moved = 0
+        while await self.redis.lmove(self.processing_key, self.name, "RIGHT", "RIGHT") is not None:
+            moved += 1
+        await self.redis.delete(self._lease_key(self.consumer_id))
+        if self.inbox:
+            await self._release_worker(self.consumer_id)
+        await self.redis.srem(self.consumers_key, self.consumer_id)
+        return moved
+
+    async def promote_delayed(self, batch: int = 100) -> int:
+        now = time.time()
+        if not self.inbox:
+            return await self._promote(keys=[self.delayed_key, self.name], args=[now, batch])
+
+        # Задача аккаунта возвращается воркеру, который держит его браузер, а не в общую очередь:
+        # иначе её заберёт другой воркер и поднимет второй браузер того же аккаунта
+        items = await self._pop_delayed(keys=[self.delayed_key], args=[now, batch])
+        if not items:
+            return 0
+        tasks = []
+        for raw in items:
+            try:
+                tasks.append(json.loads(raw))
+            except ValueError:
+                logger.error(f"☠️ Malformed delayed task moved to {self.dead_key}: {raw[:200]}")
+                await self.redis.lpush(self.dead_key, raw)
+        try:
+            return await route_tasks(self.redis, tasks, self.name, head=True)
+        except Exception:
+            # Не теряем ретраи: обратно в delayed, следующий цикл обслуживания повторит
+            await self.redis.zadd(self.delayed_key, {json.dumps(t): now for t in tasks})
+            raise
+
+    async def reclaim_dead_consumers(self) -> int:
+        """Забирает задачи воркеров, чей lease истёк"""
+        reclaimed = 0
+        for consumer_id in await self.redis.smembers(self.consumers_key):
+            if consumer_id == self.consumer_id:
+                continue
+            if await self.redis.exists(self._lease_key(consumer_id)):
+                continue
+            count = await self._reclaim(self._processing_key(consumer_id), consumer_id)
+            if self.inbox:
+                await self._release_worker(consumer_id)
+            await self.redis.srem(self.consumers_key, consumer_id)
+            if count:
+                logger.warning(f"♻️ Reclaimed {count} tasks from dead worker {consumer_id}")
+            reclaimed += count
+        return reclaimed
+
+    async def _release_worker(self, consumer_id: str):
+        """Ушедший воркер: его входящая очередь - в общую, его аккаунты - без affinity"""
+        inbox = worker_inbox(consumer_id, self.name)
+        moved = 0
+        while await self.redis.lmove(inbox, self.name, "RIGHT", "LEFT") is not None:
+            moved += 1
+        accounts = [a for a, w in (await self.redis.hgetall("account_worker")).items() if w == consumer_id]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if accounts:
+                pipe.hdel("account_worker", *accounts)
+            pipe.hdel("worker_load", consumer_id)
+            pipe.hdel("worker_capacity", consumer_id)
+            await pipe.execute()
+        logger.warning(f"🔀 Worker {consumer_id} left: {moved} queued tasks and {len(accounts)} accounts rebalanced")
+
+    async def _reclaim(self, source: str, consumer_id: str) -> int:
+        """
+        Переносит задачи из processing-списка source к себе и отправляет их на ретрай.
+        Попытка засчитывается: задача, которая роняет воркер, в итоге уйдёт в dead-letter.
+        """
+        count = 0
+        while True:
+            raw = await self.redis.lmove(source, self.processing_key, "RIGHT", "LEFT")
+            if raw is None:
+                break
+            try:
+                task = json.loads(raw)
+            except ValueError:
+                task = {"raw": raw}
+            await self.fail(raw, task, f"worker {consumer_id} died while processing")
+            count += 1
+        return count
+
+    async def maintain(self):
+        """Один цикл обслуживания: lease, ретраи, задачи упавших воркеров"""
+        await self.heartbeat()
+        await self.promote_delayed()
+        await self.reclaim_dead_consumers()
+
+    async def stats(self) -> dict:
+        return {
+            "queued": await self.redis.llen(self.name),
+            "inbox": await self.redis.llen(self.inbox) if self.inbox else 0,
+            "processing": await self.redis.llen(self.processing_key),
+            "delayed": await self.redis.zcard(self.delayed_key),
+            "dead": await self.redis.llen(self.dead_key)
+        }
@@ -27,6 +27,10 @@ class VKDatingSelectors:
     # Кнопка отправки суперлайка в попапе
     BTN_SEND_SUPERLIKE = 'button:has-text("Отправить суперлайк")'
     
+    # Буст - иконка молнии, как в мобильной версии (в clicks_log не попадал)
+    BTN_BOOST = 'button:has([class*="vkuiIcon--flash"])'
+    BTN_BOOST_CONFIRM = 'button:has-text("Активировать"), button:has-text("Подключить")'
+    
     # ========== НАВИГАЦИЯ ПО ФОТО ==========
     
     PHOTO_NEXT = '.OAf1LKm6.Mq6KKuwQ'